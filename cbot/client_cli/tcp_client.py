@@ -17,38 +17,78 @@
 # with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import json
 import socket
+from collections import deque
 
 from cbot.server import DEFAULT_PORT
+from cbot.server.codec import JSON, get_codec
+from cbot.server.framing import FrameDecoder, encode_frame
 
 
 class Client:
+    PIPELINE_WINDOW = 64
+    # commands call resends after a lost connection
+    READ_ONLY = frozenset(('ps', 'info', 'stats', 'get', 'memstore'))
 
-    def __init__(self, server=None, verbose=False):
+    def __init__(self, server=None, verbose=False, encoding='json'):
         if server is None:
             server = ['localhost', DEFAULT_PORT]
-        if server[1] is None:
+        if not isinstance(server, str) and server[1] is None:
             server[1] = DEFAULT_PORT
         self.server = server
         self.socket = None
+        self.decoder = FrameDecoder()
+        self.pending = deque()
         self.verbose = verbose
+        self.encoding = encoding
+        self.codec = JSON
 
     def __del__(self):
         self.disconnect()
 
     def connect(self):
-        if self.verbose:
-            print(f'Connecting to {self.server[0]}:{self.server[1]:d}')
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.socket.connect(tuple(self.server))
-            return 0
+            if isinstance(self.server, str):
+                if self.verbose:
+                    print(f'Connecting to {self.server}')
+                self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.socket.connect(self.server)
+            else:
+                if self.verbose:
+                    print(f'Connecting to {self.server[0]}:{self.server[1]:d}')
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.socket.connect(tuple(self.server))
+            self.decoder = FrameDecoder()
+            self.decoder.line_mode = False
+            self.pending.clear()
+            self.codec = JSON
         except socket.error as msg:
             self.disconnect()
             return f'Cannot connect. {msg}'
+        if self.encoding != JSON.name:
+            return self.negotiate(self.encoding)
+        return 0
+
+    def negotiate(self, encoding: str):
+        """Switches the connection to another encoding"""
+        try:
+            codec = get_codec(encoding)
+        except ValueError as exc:
+            self.disconnect()
+            return f'Cannot use {encoding}. {exc}'
+        self.__send(self.make_request('encoding', [encoding]))
+        res = self.__recv()
+        if res == -1:
+            self.disconnect()
+            return f'Cannot use {encoding}.'
+        if res['resp_code'] != 'OK':
+            self.disconnect()
+            return f'Cannot use {encoding}. {res["output"]}'
+        self.codec = codec
+        return 0
 
     def disconnect(self):
         if self.socket:
@@ -57,58 +97,136 @@ class Client:
 
     def call(self, name: str = None, args=None, kwargs=None,
              raw_input: str = None):
-        if not args:
-            args = ()
-        if kwargs is None:
-            kwargs = {}
+        """Returns the response, with the data of a streamed one joined"""
+        parts = self.call_stream(name, args, kwargs, raw_input)
+        res = next(parts)
+        for part in parts:
+            res['data'].extend(part['data'])
+        res.pop('more', None)
+        return res
+
+    def call_stream(self, name: str = None, args=None, kwargs=None,
+                    raw_input: str = None):
+        """Yields the parts of a response as they arrive"""
+        data = self.make_request(name, args, kwargs, raw_input)
         retries = 3
         while retries:
+            retries -= 1
             if not self.socket:
                 self.connect()
-            if self.socket:
-                if raw_input:
-                    data = {
-                        'raw_input': raw_input
-                    }
-                else:
-                    data = {
-                        "cmd": name,
-                        "args": args,
-                        "kwargs": kwargs,
-                    }
-                self.__send(data)
-                try:
+            if not self.socket:
+                continue
+            if self.__send(data) != 0:
+                self.disconnect()
+                continue
+            try:
+                res = self.__recv()
+            except ConnectionResetError:
+                self.disconnect()
+                res = -1
+            if res != -1:
+                yield res
+                while res.get('more'):
                     res = self.__recv()
-                    if res != -1:
-                        return res
-                except ConnectionResetError:
-                    pass
-            retries -= 1
+                    if res == -1:
+                        raise Exception('CBot call failed.')
+                    yield res
+                return
+            # the server may have run it already, resend only what is safe
+            if not self.is_read_only(data):
+                break
         raise Exception('CBot call failed.')
 
+    @classmethod
+    def is_read_only(cls, request) -> bool:
+        if 'raw_input' in request:
+            name = (request['raw_input'].split() or [''])[0]
+        else:
+            name = request.get('cmd') or ''
+        return name.lower() in cls.READ_ONLY
+
+    def call_many(self, requests):
+        """Sends the requests, made by make_request, pipelined on one
+        connection and returns their responses in the same order. The
+        server may run them concurrently, use batch when order matters"""
+        if not self.socket and self.connect() != 0:
+            raise Exception('CBot call failed.')
+        responses = [None] * len(requests)
+        sent = done = 0
+        while done < len(requests):
+            while sent < len(requests) and sent - done < self.PIPELINE_WINDOW:
+                self.__send(dict(requests[sent], id=sent))
+                sent += 1
+            res = self.__recv()
+            if res == -1:
+                raise Exception('CBot call failed.')
+            idx = res.pop('id')
+            if responses[idx] is None:
+                responses[idx] = res
+            else:
+                responses[idx]['data'].extend(res['data'])
+            if not res.pop('more', False):
+                done += 1
+        return responses
+
+    def batch(self, requests):
+        """Runs the requests, made by make_request, in a single batch
+        request and returns their responses"""
+        return self.call('batch', args=requests)['data']
+
+    def watch(self, events=(), filters=None):
+        """Subscribes to events and yields (stream, data) pairs as they
+        arrive; the connection carries only events until disconnect"""
+        if not self.socket and self.connect() != 0:
+            raise Exception('CBot call failed.')
+        self.__send(self.make_request('subscribe', list(events), filters))
+        while True:
+            msg = self.__recv()
+            if msg == -1:
+                return
+            if 'stream' not in msg:
+                if msg['resp_code'] != 'OK':
+                    raise Exception(msg['output'])
+            elif msg['stream'] == 'BATCH':
+                for item in msg['data']:
+                    yield item['stream'], item['data']
+            else:
+                yield msg['stream'], msg['data']
+
+    @staticmethod
+    def make_request(name: str = None, args=None, kwargs=None,
+                     raw_input: str = None):
+        if raw_input:
+            return {
+                'raw_input': raw_input
+            }
+        return {
+            "cmd": name,
+            "args": args or (),
+            "kwargs": kwargs or {},
+        }
+
     def __send(self, data):
         try:
-            blob = json.dumps(data)
             if self.verbose:
-                print('SEND', blob)
-            self.socket.sendall(blob.encode('utf8') + b'\r\n')
+                print('SEND', data)
+            blob = self.codec.encode(data)
+            if isinstance(blob, str):
+                blob = blob.encode('utf8')
+            self.socket.sendall(encode_frame(blob))
             return 0
         except Exception as exc:
             print('Exception', exc)
             return -1
 
     def __recv(self):
-        res = ''
-        while True:
-            chunk = self.socket.recv(4096).decode('utf8')
-            res += chunk
-            if len(chunk) < 4096:
-                break
-        if not res:
-            self.disconnect()
-            return -1  # Connection closed
-
-        data = json.loads(res)
+        while not self.pending:
+            chunk = self.socket.recv(65536)
+            if not chunk:
+                self.disconnect()
+                return -1  # Connection closed
+            self.pending.extend(self.decoder.feed(chunk))
+        data = self.codec.decode(self.pending.popleft())
         if self.verbose:
             print('GOT', data)
         return data
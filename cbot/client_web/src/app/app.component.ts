@@ -56,9 +56,8 @@ export class AppComponent implements AfterViewInit, OnDestroy, OnInit {
     ngOnInit() {
         this.streamService.isOnline$.subscribe((isOnline: boolean) => {
             if (isOnline) {
-                this.streamService.enable(() => {
-                    this.streamService.callCmd('ps');
-                });
+                // the server sends a state snapshot on connect
+                this.streamService.enable();
             }
             else {
                 this.streamService.disable();
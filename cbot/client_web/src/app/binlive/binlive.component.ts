@@ -27,7 +27,8 @@ import { Subscription } from 'rxjs';
 })
 export class AppBinLiveComponent implements AfterViewInit, OnDestroy {
 
-    binLive = [];
+    binLive: any[] = [];
+    binLiveVersion: number = -1;
     binLiveLastUpdate: Date = new Date();
     streamSub!: Subscription;
 
@@ -48,11 +49,54 @@ export class AppBinLiveComponent implements AfterViewInit, OnDestroy {
 
     onStream(event: StreamEvent) {
         if (event.type === StreamType.BIN_LIVE_UPDATE) {
-            this.binLive = event.data;
+            this.applyBinLive(event.data);
             this.binLiveLastUpdate = new Date();
         }
     }
 
+    applyBinLive(data: any) {
+        if (data.full) {
+            // Always taken, versions start over when the server restarts
+            this.binLive = data.rows;
+            this.binLiveVersion = data.version;
+            return;
+        }
+        if (this.binLiveVersion >= 0 && data.version <= this.binLiveVersion) {
+            // Already part of the board, e.g. sent before the snapshot
+            return;
+        }
+        if (this.binLiveVersion < 0 || data.version !== this.binLiveVersion + 1) {
+            // Missed a delta, wait for the next keyframe
+            this.binLiveVersion = -1;
+            return;
+        }
+        const binLive = this.binLive.slice();
+        for (let row of data.rows) {
+            const idx = binLive.findIndex(item => item.s === row.s);
+            if (idx >= 0) {
+                binLive[idx] = row;
+            }
+            else if (!data.moves) {
+                binLive.push(row);
+            }
+        }
+        if (!data.moves) {
+            // Filtered by symbol, the ranks are not known
+            binLive.sort((a, b) => parseFloat(b['5m']) - parseFloat(a['5m']));
+            this.binLive = binLive;
+            this.binLiveVersion = data.version;
+            return;
+        }
+        for (let [symbol, rank] of data.moves) {
+            const idx = binLive.findIndex(item => item.s === symbol);
+            const row = idx >= 0 ? binLive.splice(idx, 1)[0] :
+                data.rows.find((item: any) => item.s === symbol);
+            binLive.splice(rank, 0, row);
+        }
+        this.binLive = binLive;
+        this.binLiveVersion = data.version;
+    }
+
     isPositive(num: string) {
         return parseFloat(num) > 0;
     }
@@ -111,12 +111,25 @@ export class StreamService {
         this.ws.send(payload);
     }
 
-    callCmd(cmd: string, args: string[] = [], kwargs: any = {}) {
-        this.send({
+    callCmd(cmd: string, args: string[] = [], kwargs: any = {}, id: any = null) {
+        let data: any = {
             cmd: cmd,
             args: args,
             kwargs: kwargs,
-        });
+        };
+        if (id !== null) {
+            // tagged commands run concurrently, RESULT carries the same id
+            data.id = id;
+        }
+        this.send(data);
+    }
+
+    subscribe(events: string[], filters: any = {}) {
+        this.callCmd('subscribe', events, filters);
+    }
+
+    unsubscribe(events: string[]) {
+        this.callCmd('unsubscribe', events);
     }
 
     callCmdRaw(cmd: string) {
@@ -125,16 +138,29 @@ export class StreamService {
 
     processResponse(payload: any) {
         let d = JSON.parse(payload);
+        if (d.stream === 'BATCH') {
+            // several frames packed by the server, in order
+            for (let frame of d.data) {
+                this.processFrame(frame);
+            }
+        }
+        else {
+            this.processFrame(d);
+        }
+    }
+
+    processFrame(d: any) {
         let stream = d.stream;
         let data = d.data;
         switch (stream) {
             case StreamType.LOGGER:
-                let ts = data.ts;
-                let time = parseInt(ts.toString().split('.')[0], 10);
-                let taskId = data.taskId;
-                let msg = data.msg;
-                this.emitLogger(new Date(time * 1000).toISOString() +
-                    ` ${taskId} - ${msg}`, taskId);
+                // printer lines arrive batched, oldest first
+                for (let entry of data) {
+                    let time = parseInt(entry.ts.toString().split('.')[0], 10);
+                    let taskId = entry.taskId;
+                    this.emitLogger(new Date(time * 1000).toISOString() +
+                        ` ${taskId} - ${entry.msg}`, taskId);
+                }
                 break;
             case StreamType.BIN_LIVE_UPDATE:
             case StreamType.CMC_LATEST_UPDATE:
@@ -176,7 +202,7 @@ export class StreamService {
                     }
                 }
                 else if (!('resp_code' in d)) {
-                    this.emitLogger('Unknown: ' + payload);
+                    this.emitLogger('Unknown: ' + JSON.stringify(d));
                 }
                 this.emit(stream, data, data.taskId);
                 break;
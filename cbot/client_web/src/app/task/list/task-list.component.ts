@@ -59,8 +59,11 @@ export class AppTaskListComponent implements AfterViewInit, OnDestroy {
     modifyTask: Task | null = null;
     createMode: boolean = false;
     streamSub!: Subscription;
+    tasks: Map<number, Task> = new Map();
     tasksFinished: Task[] = [];
     tasksRunning: Task[] = [];
+    tasksVersion: number = -1;
+    tasksResyncing: boolean = false;
 
     @Output() switchToTerminal = new EventEmitter();
 
@@ -98,12 +101,7 @@ export class AppTaskListComponent implements AfterViewInit, OnDestroy {
             }
         }
         else if (event.type === StreamType.TASK_MANAGER) {
-            const tasks = event.data.tasks as Task[];
-            if (!this.tasksRunning.length) {
-                this.streamService.callCmd('get', ['-1', '1']);
-            }
-            this.tasksRunning = tasks.filter(item => !item.is_finished);
-            this.tasksFinished = tasks.filter(item => item.is_finished);
+            this.applyTaskList(event.data);
         }
         else if (event.type === StreamType.CRYPTO_TSL_UPDATE) {
             let task = this.tasksRunning.find(item => item.id === event.taskId)
@@ -127,6 +125,43 @@ export class AppTaskListComponent implements AfterViewInit, OnDestroy {
         }
     }
 
+    applyTaskList(data: any) {
+        if (data.full) {
+            const tasks = new Map<number, Task>();
+            for (let task of data.tasks as Task[]) {
+                tasks.set(task.id, Object.assign(this.tasks.get(task.id) || {}, task));
+            }
+            this.tasks = tasks;
+            this.tasksResyncing = false;
+        }
+        else {
+            if (data.version <= this.tasksVersion) {
+                return;
+            }
+            if (data.version !== this.tasksVersion + 1) {
+                // Missed a diff, ask for a new snapshot once
+                if (!this.tasksResyncing) {
+                    this.tasksResyncing = true;
+                    this.streamService.callCmd('ps');
+                }
+                return;
+            }
+            for (let task of data.added.concat(data.changed) as Task[]) {
+                this.tasks.set(task.id, Object.assign(this.tasks.get(task.id) || {}, task));
+            }
+            for (let taskId of data.removed as number[]) {
+                this.tasks.delete(taskId);
+            }
+        }
+        this.tasksVersion = data.version;
+        if (!this.tasksRunning.length) {
+            this.streamService.callCmd('get', ['-1', '1']);
+        }
+        const tasks = Array.from(this.tasks.values()).sort((a, b) => a.id - b.id);
+        this.tasksRunning = tasks.filter(item => !item.is_finished);
+        this.tasksFinished = tasks.filter(item => item.is_finished);
+    }
+
     cleanTasks() {
         this.taskService.clean();
     }
@@ -21,7 +21,9 @@
 import sys
 import cmd
 import getopt
+import json
 import os.path
+import shlex
 from datetime import datetime
 
 try:
@@ -221,8 +223,16 @@ class Shell(cmd.Cmd):
         return list(filter(lambda x: x.startswith(text), k))
 
     def do_ps(self, arg):
+        """
+          - name=crypto_tsl
+          - state=running/paused/finished
+        """
         self.call('PS', arg)
 
+    def complete_ps(self, text, _line, _begidx, _endidx):  # pylint: disable=R0201
+        k = ['name=', 'state=']
+        return list(filter(lambda x: x.startswith(text), k))
+
     def do_ls(self, arg):
         self.do_ps(arg)
 
@@ -269,17 +279,48 @@ class Shell(cmd.Cmd):
     def do_get(self, arg):
         """
           - 1 25
+          - 1 since=120
+          - -1 limit=100 since_ts=1650000000 name=crypto_tsl level=error
         """
         raw_input = 'GET'
         if arg:
             raw_input += ' ' + arg
-        res = self.client.call(raw_input=raw_input)
-        for line in res['data']:
-            ts = line['ts']
-            task_id = line['taskId']
-            msg = line['msg']
-            print('%s %d - %s' % (
-                datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), task_id, msg))
+        for res in self.client.call_stream(raw_input=raw_input):
+            for line in res['data']:
+                print_log_line(line)
+
+    def do_tail(self, arg):
+        """
+        Prints the output of tasks as it is logged, until Ctrl-C
+          - taskId=12
+        """
+        _events, filters = parse_watch_args(arg)
+        self.watch(['LOGGER'], filters)
+
+    def do_watch(self, arg):
+        """
+        Prints events as they are emitted, until Ctrl-C
+          - TASK_MANAGER
+          - CRYPTO_TSL_UPDATE taskId=12 hz=1
+          - TICKER_UPDATE symbol=BTC/USDT
+        """
+        events, filters = parse_watch_args(arg)
+        self.watch(events or ['TASK_MANAGER'], filters)
+
+    def watch(self, events, filters):
+        try:
+            for stream, data in self.client.watch(events, filters):
+                if stream == 'LOGGER':
+                    for line in data if isinstance(data, list) else [data]:
+                        print_log_line(line)
+                else:
+                    print(stream, json.dumps(data))
+        except KeyboardInterrupt:
+            pass
+        except Exception as exc:
+            print(exc)
+        finally:
+            self.client.disconnect()
 
     def do_cron(self, arg):
         """
@@ -293,6 +334,8 @@ class Shell(cmd.Cmd):
   │ │ │ │ │
   * * * * *
 
+  An optional leading field adds seconds resolution: "*/10 * * * * *"
+
   1) cron
   2) cron rm=1
   3) cron modify=2 cron="* * * * *"
@@ -341,12 +384,14 @@ class Shell(cmd.Cmd):
 def main():
     interactive = True
     server = None
+    encoding = 'json'
     verbosity = 0
 
     getopt_shorts = 'ev:'
     getopt_longs = (
         'verbosity=',
         'server=',
+        'encoding=',
     )
 
     try:
@@ -357,8 +402,12 @@ def main():
                 verbosity = int(a)
             elif o == '-e':
                 interactive = False
+            elif o == '--encoding':
+                encoding = a
             elif o == '--server':
-                if ':' in a:
+                if a.startswith('/'):
+                    server = a
+                elif ':' in a:
                     addr, port = a.split(':', 1)
                     server = [addr, int(port)]
                 else:
@@ -368,13 +417,17 @@ def main():
         print("""%s -- BOT
 
         -v, --verbosity=LEVEL
-            --server=HOST:PORT
+        -e  COMMAND [ARGS...]   run a command and exit,
+            with `-` run the commands read from stdin as one batch
+            --server=HOST:PORT|/PATH/TO/UNIX_SOCKET
+            --encoding=json|msgpack
         """ % (sys.argv[0]))
         sys.exit(0)
 
-    client = Client(server=server, verbose=bool(verbosity))
-    if client.connect() != 0:
-        print("Can't connect!")
+    client = Client(server=server, verbose=bool(verbosity), encoding=encoding)
+    err = client.connect()
+    if err != 0:
+        print("Can't connect!", err)
         sys.exit(1)
 
     if interactive:
@@ -389,27 +442,54 @@ def main():
         if not cmd_args:
             print('Nothing to send!')
             sys.exit(1)
-        args = ' '.join(cmd_args[1:])
-        ri = cmd_args[0]
-        if args:
-            ri += ' ' + args
-        res = client.call(raw_input=ri)
-        if cmd_args[0] == 'get':
-            for line in res['data']:
-                ts = line['ts']
-                task_id = line['taskId']
-                msg = line['msg']
-                print('%s %d - %s' % (
-                    datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S'), task_id, msg))
-        elif isinstance(res['output'], list):
-            for line in res['output']:
-                print(line)
-        elif isinstance(res['output'], str) and res['output']:
-            print(res['output'])
-        elif verbosity:
-            print(res['resp_code'])
+        if cmd_args[0] in ('tail', 'watch'):
+            Shell(client).onecmd(' '.join(cmd_args))
+        elif cmd_args == ['-']:
+            lines = [line.strip() for line in sys.stdin]
+            lines = [line for line in lines if line and not line.startswith('#')]
+            results = client.batch([Client.make_request(raw_input=line)
+                                    for line in lines])
+            for line, res in zip(lines, results):
+                print_result(line.split()[0], res, verbosity)
+        else:
+            args = ' '.join(cmd_args[1:])
+            ri = cmd_args[0]
+            if args:
+                ri += ' ' + args
+            print_result(cmd_args[0], client.call(raw_input=ri), verbosity)
         client.disconnect()
 
 
+def print_result(cmd_name: str, res, verbosity: int):
+    if cmd_name == 'get':
+        for line in res['data']:
+            print_log_line(line)
+    elif isinstance(res['output'], list):
+        for line in res['output']:
+            print(line)
+    elif isinstance(res['output'], str) and res['output']:
+        print(res['output'])
+    elif verbosity:
+        print(res['resp_code'])
+
+
+def print_log_line(line):
+    print('%s %d - %s' % (
+        datetime.fromtimestamp(line['ts']).strftime('%Y-%m-%d %H:%M:%S'),
+        line['taskId'], line['msg']))
+
+
+def parse_watch_args(arg: str):
+    events = []
+    filters = {}
+    for item in shlex.split(arg or ''):
+        if '=' in item:
+            key, value = item.split('=', 1)
+            filters[key.strip()] = value.strip()
+        else:
+            events.append(item.upper())
+    return events, filters
+
+
 if __name__ == '__main__':
     main()
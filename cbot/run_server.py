@@ -33,7 +33,8 @@ from setproctitle import setproctitle  # pylint: disable=no-name-in-module
 
 from cbot import __version__
 from cbot.server import logger as logger_service, exchange, DEFAULT_PORT
-from cbot.server import config
+from cbot.server import config, serializer
+from cbot.server.event_bus import event_bus, Event, SNAPSHOT_EVENTS
 from cbot.server.logger import logger
 from cbot.server.savegame import save_data, load_data
 from cbot.server.task_manager import task_manager
@@ -41,7 +42,8 @@ from cbot.server.tcp_server import Server
 from cbot.server.ws_server import Server as WsServer
 
 
-async def shutdown(sig_name: str, ws_server: WsServer, loop: AbstractEventLoop):
+async def shutdown(sig_name: str, server: Server, ws_server: WsServer,
+                   loop: AbstractEventLoop):
     logger.info('Caught %s, shutting down...', sig_name)
     await exchange.close_all()
     tasks = [task for task in asyncio.all_tasks() if task is not
@@ -49,6 +51,8 @@ async def shutdown(sig_name: str, ws_server: WsServer, loop: AbstractEventLoop):
     list(map(lambda task: task.cancel(), tasks))
     await asyncio.gather(*tasks, return_exceptions=True)
 
+    server.close()
+    await server.wait_closed()
     ws_server.close()
     await ws_server.wait_closed()
 
@@ -150,18 +154,35 @@ def main():
 
         logger.info('Starting CBot (%s)', _get_version())
 
+        server_conf = config.conf.sections['server']
+        coalesce_window = server_conf.get('event_coalesce_window')
+        if coalesce_window:
+            for event_name in SNAPSHOT_EVENTS:
+                event_bus.set_coalescing(event_name, float(coalesce_window))
+        logger_batch_window = server_conf.get('logger_batch_window')
+        if logger_batch_window:
+            event_bus.set_batching(Event.LOGGER, float(logger_batch_window))
+        if server_conf.get('json_backend'):
+            serializer.use_backend(server_conf.get('json_backend'))
+        task_manager.scheduler.spread = float(server_conf.get('cron_spread', 0))
+        task_manager.cron_admission.rate = float(server_conf.get('cron_exchange_rate', 0))
+
         loop = asyncio.get_event_loop()
-        server = Server(loop, config.conf.bind[0], config.conf.bind[1])
-        server.listen()
+        server = Server(config.conf.bind[0], config.conf.bind[1],
+                        backlog=int(server_conf.get('tcp_backlog', 0)),
+                        idle_timeout=float(server_conf.get('tcp_idle_timeout',
+                                                           Server.IDLE_TIMEOUT)),
+                        max_connections=int(server_conf.get('tcp_max_connections', 0)),
+                        unix_socket=server_conf.get('unix_socket'))
+        loop.run_until_complete(server.run())
         ws_server = WsServer(config.conf.bind[0], config.conf.bind[1] + 1)
 
         for sig_name in ('SIGINT', 'SIGTERM'):
             loop.add_signal_handler(
                 getattr(signal, sig_name),
                 lambda: asyncio.create_task(
-                    shutdown(sig_name, ws_server, loop)))  # pylint: disable=cell-var-from-loop
+                    shutdown(sig_name, server, ws_server, loop)))  # pylint: disable=cell-var-from-loop
 
-        asyncio.ensure_future(server.run(), loop=loop)
         asyncio.ensure_future(ws_server.run(), loop=loop)
         asyncio.ensure_future(load_data(), loop=loop)
         asyncio.ensure_future(task_manager.scheduler_start(), loop=loop)
@@ -0,0 +1,104 @@
+"""
+# codec.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+from typing import Any, List, Union
+
+from cbot.server import serializer
+
+ENCODINGS = ('json', 'msgpack')
+
+
+class JsonCodec:
+    """The default encoding, messages are UTF-8 JSON text"""
+
+    name = 'json'
+    binary = False
+
+    @staticmethod
+    def encode(obj: Any) -> str:
+        return serializer.dumps(obj)
+
+    @staticmethod
+    def decode(data: Union[str, bytes]) -> Any:
+        return serializer.loads(data)
+
+    @staticmethod
+    def frame(payload: Any) -> str:
+        """Encodes a queued payload, a JSON str or a Frame"""
+        return payload if isinstance(payload, str) else payload.encode()
+
+    @staticmethod
+    def batch(payloads: List[str]) -> str:
+        return '{"stream":"BATCH","data":[' + ','.join(payloads) + ']}'
+
+
+class MsgpackCodec:
+    """Messages are msgpack maps with the same keys as the JSON ones.
+
+    Frames are packed once for all msgpack clients. Payloads that were
+    queued pre-encoded as JSON, such as command results and snapshots,
+    are converted on the way out."""
+
+    name = 'msgpack'
+    binary = True
+
+    @staticmethod
+    def encode(obj: Any) -> bytes:
+        return serializer.packb(obj)
+
+    @staticmethod
+    def decode(data: bytes) -> Any:
+        return serializer.unpackb(data)
+
+    @staticmethod
+    def frame(payload: Any) -> bytes:
+        """Encodes a queued payload, packed bytes, a JSON str or a Frame"""
+        if isinstance(payload, bytes):
+            return payload
+        if isinstance(payload, str):
+            return serializer.packb(serializer.loads(payload))
+        return payload.pack()
+
+    @staticmethod
+    def batch(payloads: List[bytes]) -> bytes:
+        # the packed frames are spliced into the array of an empty batch
+        prefix = serializer.packb({'stream': 'BATCH', 'data': []})[:-1]
+        size = len(payloads)
+        if size < 16:
+            header = bytes((0x90 | size,))
+        elif size < 0x10000:
+            header = struct.pack('>BH', 0xdc, size)
+        else:
+            header = struct.pack('>BI', 0xdd, size)
+        return prefix + header + b''.join(payloads)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+
+
+def get_codec(name: str = 'json') -> Union[JsonCodec, MsgpackCodec]:
+    if name not in ENCODINGS:
+        raise ValueError('Unknown encoding: %s' % name)
+    if name == 'msgpack':
+        if not serializer.msgpack:
+            raise ValueError('msgpack is not installed')
+        return MSGPACK
+    return JSON
@@ -0,0 +1,343 @@
+"""
+# connection.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from cbot.server import serializer
+from cbot.server.codec import JSON
+from cbot.server.event_bus import Event, SNAPSHOT_EVENTS
+from cbot.server.logger import logger
+from cbot.server.operation import Operation
+from cbot.server.subscription import Subscription
+
+# only the newest queued frame of these is kept
+COALESCE_STREAMS = frozenset(SNAPSHOT_EVENTS)
+# frames of these are dropped when the queue is full
+# (a client that misses a BIN_LIVE_UPDATE delta waits for the next keyframe)
+DROP_STREAMS = frozenset((Event.BIN_LIVE_UPDATE, Event.CRYPTO_TSL_UPDATE, Event.LOGGER))
+# versioned deltas, a frame held back by a rate cap would be a gap
+DELTA_STREAMS = frozenset((Event.BIN_LIVE_UPDATE, Event.TASK_MANAGER))
+# default max frames per second of a stream (per task for TSL updates)
+STREAM_RATES = {
+    Event.CRYPTO_TSL_UPDATE: 2,
+    Event.STREAM_TICKERS: 2,
+}
+
+
+class Frame:
+    """Event payload shared by all clients that get the same data,
+    encoded on first use only, so frames throttled away cost nothing"""
+
+    def __init__(self, stream: Any, data: Any, encoder: Callable[[Dict], str]):
+        self.stream = stream
+        self.data = data
+        self.encoder = encoder
+        self._encoded: Optional[str] = None
+        self._packed: Optional[bytes] = None
+
+    def encode(self) -> str:
+        if self._encoded is None:
+            self._encoded = self.encoder({
+                'stream': self.stream,
+                'data': self.data,
+            })
+        return self._encoded
+
+    def pack(self) -> bytes:
+        if self._packed is None:
+            self._packed = serializer.packb({
+                'stream': self.stream,
+                'data': self.data,
+            })
+        return self._packed
+
+
+class Connection:
+    """Outbound side of a client connection.
+
+    Frames are queued and written by a dedicated task, so a client on a
+    slow link only delays itself. When the queue is full, high-rate
+    streams are coalesced or dropped; a client that cannot take any
+    other frame, or whose oldest frame is older than MAX_LAG seconds,
+    is evicted.
+
+    Streams with a rate cap deliver at most that many frames per second,
+    keeping only the newest one in between. Frames that are pending
+    together are written as one BATCH frame, in the encoding of the
+    connection's codec.
+    """
+
+    MAXSIZE = 1000
+    MAX_LAG = 30
+    BATCH_MAX = 100
+
+    def __init__(self, name: str, send: Callable[[Any], Awaitable],
+                 on_evict: Callable[['Connection'], None] = None):
+        self.name = name
+        self.send = send
+        self.on_evict = on_evict
+        self.subscription = Subscription()
+        self.codec = JSON
+        self.queue: Deque[List] = deque()
+        self.latest: Dict[Any, List] = {}
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.is_evicted = False
+        self.in_flight: Optional[List] = None
+        self.rates: Dict[Any, float] = dict(STREAM_RATES)
+        self.throttled: Dict[tuple, Any] = {}
+        self.throttled_count = 0
+        self._last_release: Dict[tuple, float] = {}
+        self._release_handles: Dict[tuple, asyncio.TimerHandle] = {}
+        self._ready = asyncio.Event()
+        self._empty = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write())
+
+    def close(self):
+        if self._writer:
+            self._writer.cancel()
+            self._writer = None
+        for handle in self._release_handles.values():
+            handle.cancel()
+        self._release_handles.clear()
+        self.throttled.clear()
+        self.queue.clear()
+        self.latest.clear()
+        self._empty.set()
+
+    def set_rate(self, stream: Any, rate: Optional[float]):
+        """Caps a stream at rate frames per second, 0 or None removes
+        the cap"""
+        if rate:
+            self.rates[stream] = rate
+        else:
+            self.rates.pop(stream, None)
+
+    def put(self, stream: Any, payload: Any, key: Any = None):
+        """Queues a JSON str, packed bytes or Frame payload; key tells
+        apart the items of a stream that are rate capped separately,
+        e.g. a taskId"""
+        if self.is_evicted:
+            return
+        rate = self.rates.get(stream)
+        if rate:
+            self._put_throttled((stream, key), payload, 1 / rate)
+            return
+        self._enqueue(stream, payload)
+
+    def _put_throttled(self, throttle_key: tuple, payload: Any, interval: float):
+        if throttle_key in self.throttled:
+            self.throttled_count += 1
+        self.throttled[throttle_key] = payload
+        if throttle_key in self._release_handles:
+            return
+        delay = self._last_release.get(throttle_key, 0) + interval - time.monotonic()
+        if delay <= 0:
+            self._release(throttle_key)
+        else:
+            self._release_handles[throttle_key] = asyncio.get_running_loop().call_later(
+                delay, self._release, throttle_key)
+
+    def _release(self, throttle_key: tuple):
+        self._release_handles.pop(throttle_key, None)
+        payload = self.throttled.pop(throttle_key, None)
+        if payload is not None:
+            self._last_release[throttle_key] = time.monotonic()
+            self._enqueue(throttle_key[0], payload)
+
+    def _enqueue(self, stream: Any, payload: Any):
+        if self.is_evicted:
+            return
+        now = time.monotonic()
+        lag = self.get_lag(now)
+        if lag > self.MAX_LAG:
+            self.evict('lagging %.1fs behind' % lag)
+            return
+        if stream in COALESCE_STREAMS:
+            entry = self.latest.get(stream)
+            if entry is not None:
+                entry[1] = payload
+                self.coalesced += 1
+                return
+        if len(self.queue) >= self.MAXSIZE:
+            if stream in COALESCE_STREAMS or stream in DROP_STREAMS:
+                self.dropped += 1
+                return
+            self.evict('queue full')
+            return
+        entry = [stream, payload, now]
+        if stream in COALESCE_STREAMS:
+            self.latest[stream] = entry
+        self.queue.append(entry)
+        self._empty.clear()
+        self._ready.set()
+
+    async def drain(self):
+        """Waits until all queued frames are written"""
+        if self._writer:
+            await self._empty.wait()
+
+    def evict(self, reason: str):
+        logger.warning('Evicting slow client %s: %s', self.name, reason)
+        self.is_evicted = True
+        self.close()
+        if self.on_evict:
+            self.on_evict(self)
+
+    def get_lag(self, now: float = None) -> float:
+        """Age of the oldest frame not written yet"""
+        oldest = self.in_flight or (self.queue[0] if self.queue else None)
+        if oldest is None:
+            return 0
+        return (now or time.monotonic()) - oldest[2]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'subscription': str(self.subscription),
+            'depth': len(self.queue),
+            'lag': round(self.get_lag(), 3),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'throttled': self.throttled_count,
+        }
+
+    async def _write(self):
+        while True:
+            if not self.queue:
+                self._empty.set()
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            entries = []
+            while self.queue and len(entries) < self.BATCH_MAX:
+                entry = self.queue.popleft()
+                if self.latest.get(entry[0]) is entry:
+                    del self.latest[entry[0]]
+                entries.append(entry)
+            payloads = [self.codec.frame(e[1]) for e in entries]
+            if len(payloads) == 1:
+                payload = payloads[0]
+            else:
+                payload = self.codec.batch(payloads)
+            self.in_flight = entries[0]
+            try:
+                await self.send(payload)
+            except Exception as exc:
+                logger.debug('Send to %s failed: %s', self.name, exc)
+                self._writer = None
+                self.close()
+                return
+            finally:
+                self.in_flight = None
+            self.sent += len(entries)
+
+
+class RequestDispatcher:
+    """Runs the requests of a single client connection.
+
+    Requests tagged with an id run concurrently, up to max_in_flight of
+    them, and their responses are sent as they complete. Untagged
+    requests run one after another. A request that raises gets an ERR
+    response, sent by calling run with no data.
+    """
+
+    def __init__(self, run: Callable[[Operation, Optional[Dict]], Awaitable],
+                 max_in_flight: int):
+        self.run = run
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.pending: Set[asyncio.Task] = set()
+
+    async def dispatch(self, op: Operation, data: Optional[Dict],
+                       concurrent: bool = True):
+        if not concurrent or data is None or op.request_id is None:
+            await self.run_safe(op, data)
+            return
+        await self.in_flight.acquire()
+        task = asyncio.create_task(self.run_safe(op, data))
+        task.add_done_callback(lambda _t: self.in_flight.release())
+        task.add_done_callback(self.pending.discard)
+        self.pending.add(task)
+
+    async def run_safe(self, op: Operation, data: Optional[Dict]):
+        try:
+            await self.run(op, data)
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.exception('Exception')
+            op.set_error(exc)
+            await self.run(op, None)
+
+    async def wait(self):
+        """Waits for the running requests to finish"""
+        if self.pending:
+            await asyncio.gather(*self.pending, return_exceptions=True)
+
+    def cancel(self):
+        for task in list(self.pending):
+            task.cancel()
+
+
+def process_subscription(con: Connection, op: Operation):
+    """Handles the subscribe and unsubscribe commands, which apply to
+    a single connection"""
+    subscription = con.subscription
+    try:
+        if op.cmd == 'subscribe':
+            kwargs = dict(op.kwargs)
+            rate = float(kwargs.pop('hz')) if 'hz' in kwargs else None
+            if rate is not None:
+                for event_name in map(Event, op.args):
+                    if event_name in DELTA_STREAMS:
+                        raise ValueError('hz cannot be used with %s' % event_name.value)
+            subscription.subscribe(op.args or ['ALL'], kwargs)
+            if rate is not None:
+                for event_name in op.args:
+                    con.set_rate(Event(event_name), rate)
+        else:
+            subscription.unsubscribe(op.args)
+        op.output = 'Subscribed: %s' % subscription
+    except ValueError as exc:
+        op.resp_code = 'ERR'
+        op.output = str(exc)
+
+
+def broadcast(connections: Iterable[Connection], stream_name: Event, data: Any,
+              encoder: Callable[[Dict], str]):
+    """Queues an event on every connection subscribed to it, clients
+    that select the same data share one Frame"""
+    if data is None:
+        data = {}
+    frames: Dict[Any, Frame] = {}
+    task_id = data.get('taskId') if isinstance(data, dict) else None
+    for con in list(connections):
+        key, selected = con.subscription.select(stream_name, data)
+        if selected is None:
+            continue
+        frame = frames.get(key)
+        if frame is None:
+            frame = frames[key] = Frame(stream_name, selected, encoder)
+        con.put(stream_name, frame, task_id)
@@ -0,0 +1,309 @@
+"""
+# cron.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import calendar
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from heapq import heappop, heappush
+from itertools import count
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cbot.server.logger import logger
+from cbot.server.operation import Operation
+
+DAY_NAMES = [x.lower() for x in calendar.day_name[6:] + calendar.day_name[:6]]
+DAY_ABBRS = [x.lower() for x in calendar.day_abbr[6:] + calendar.day_abbr[:6]]
+
+# (name, min, max) of every field of a six-field schedule
+FIELDS = (
+    ('second', 0, 59),
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 6),
+)
+
+
+def _to_int(value: str, allow_daynames: bool = False) -> int:
+    value = value.strip().lower()
+    if allow_daynames:
+        if value in DAY_NAMES:
+            return DAY_NAMES.index(value)
+        if value in DAY_ABBRS:
+            return DAY_ABBRS.index(value)
+        if value == '7':
+            return 0
+    return int(value)
+
+
+def _parse_field(value: str, name: str, lo: int, hi: int) -> List[int]:
+    allow_daynames = name == 'day of week'
+    res = set()
+    for part in filter(None, [x.strip() for x in value.split(',')]):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f'Invalid step in {name}: {value}')
+        if part == '*':
+            # like pycron, */n matches values divisible by n
+            res.update(v for v in range(lo, hi + 1) if v % step == 0)
+            continue
+        if '-' in part:
+            start_str, end_str = part.split('-', 1)
+            start = _to_int(start_str, allow_daynames)
+            end = _to_int(end_str, allow_daynames)
+        else:
+            start = _to_int(part, allow_daynames)
+            end = hi if step > 1 else start
+        if not lo <= start <= hi or not lo <= end <= hi:
+            raise ValueError(f'Value out of range in {name}: {value}')
+        if start <= end:
+            res.update(range(start, end + 1, step))
+        else:  # wrapping range, e.g. fri-mon
+            res.update(list(range(start, hi + 1)) + list(range(lo, end + 1)))
+    if not res:
+        raise ValueError(f'Empty {name}: {value}')
+    return sorted(res)
+
+
+class CronSchedule:
+    """Parsed cron schedule: "min hour dom month dow" or, with seconds
+    resolution, "sec min hour dom month dow". Day of month and day of week
+    must both match, as in pycron."""
+
+    MAX_YEARS_AHEAD = 5
+
+    def __init__(self, schedule: str):
+        fields = schedule.split()
+        if len(fields) == 5:
+            fields.insert(0, '0')
+        if len(fields) != 6:
+            raise ValueError(f'Invalid cron schedule: {schedule}')
+        (self.seconds, self.minutes, self.hours,
+         self.days, self.months, self.weekdays) = [
+            _parse_field(value, *field) for value, field in zip(fields, FIELDS)]
+
+    def matches(self, dt: datetime) -> bool:
+        return dt.second in self.seconds and dt.minute in self.minutes \
+            and dt.hour in self.hours and dt.day in self.days \
+            and dt.month in self.months and dt.isoweekday() % 7 in self.weekdays
+
+    def next_after(self, dt: datetime) -> Optional[datetime]:
+        """Returns the first matching time strictly after dt"""
+        t = dt.replace(microsecond=0) + timedelta(seconds=1)
+        limit = dt.replace(year=dt.year + self.MAX_YEARS_AHEAD, day=1)
+        while t < limit:
+            if t.month not in self.months:
+                t = self._next_month(t)
+                continue
+            if t.day not in self.days or t.isoweekday() % 7 not in self.weekdays:
+                t = t.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+                continue
+            hour = self._next_value(self.hours, t.hour)
+            if hour is None:
+                t = t.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+                continue
+            if hour != t.hour:
+                t = t.replace(hour=hour, minute=0, second=0)
+            minute = self._next_value(self.minutes, t.minute)
+            if minute is None:
+                t = t.replace(minute=0, second=0) + timedelta(hours=1)
+                continue
+            if minute != t.minute:
+                t = t.replace(minute=minute, second=0)
+            second = self._next_value(self.seconds, t.second)
+            if second is None:
+                t = t.replace(second=0) + timedelta(minutes=1)
+                continue
+            return t.replace(second=second)
+        return None
+
+    @staticmethod
+    def _next_value(values: List[int], current: int) -> Optional[int]:
+        pos = bisect_left(values, current)
+        return values[pos] if pos < len(values) else None
+
+    @staticmethod
+    def _next_month(t: datetime) -> datetime:
+        if t.month == 12:
+            return datetime(t.year + 1, 1, 1)
+        return datetime(t.year, t.month + 1, 1)
+
+
+class CronEntity:
+    schedule: str
+    op: Operation
+    is_paused: bool = False
+
+    def __init__(self, schedule: str, op: Operation, is_paused: bool = False):
+        self.schedule = schedule
+        self.op = op
+        self.is_paused = is_paused
+        self.cron = CronSchedule(schedule)
+        self.next_run: Optional[datetime] = None
+        # bumped on every reschedule, heap items of older ones are stale
+        self.generation = 0
+
+    def __str__(self):
+        return f'{self.schedule} {self.op}{" (paused)" if self.is_paused else ""}'
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.next_run = None
+        self.generation = 0
+        try:
+            self.cron = CronSchedule(self.schedule)
+        except ValueError:
+            logger.error('Invalid cron schedule: %s', self.schedule)
+            self.cron = None
+
+
+class CronScheduler:
+    """Keeps cron entries in a min-heap ordered by their next run time and
+    sleeps until the earliest one is due.
+
+    With spread set, every entry fires at a fixed offset within the first
+    `spread` seconds after its scheduled time, derived from a hash of the
+    entry, so entries sharing a schedule do not all start at once. The
+    offset is computed on reschedule and kept in the heap item, as the
+    entry's op may be modified later.
+    """
+
+    # Wake up at least this often to notice wall clock changes
+    MAX_SLEEP = 60
+
+    def __init__(self, fire: Callable[[CronEntity], None], spread: float = 0):
+        self.fire = fire
+        self.spread = spread
+        self.entries: List[CronEntity] = []
+        self.heap: List[Tuple[datetime, int, CronEntity, int, timedelta]] = []
+        self.is_running = False
+        self._counter = count()
+        self._last_now: Optional[datetime] = None
+        self._wakeup: Optional[asyncio.Future] = None
+
+    def get_offset(self, entry: CronEntity) -> timedelta:
+        if not self.spread:
+            return timedelta()
+        op = entry.op
+        key = f'{entry.schedule} {op.cmd} {op.args} {sorted(op.kwargs.items())}'
+        return timedelta(seconds=zlib.crc32(key.encode('utf8')) / 2 ** 32 * self.spread)
+
+    def reschedule(self, entries: List[CronEntity], now: datetime = None):
+        """Recomputes next run times of all entries, e.g. after the cron
+        list changed"""
+        now = now or datetime.now()
+        self.entries = entries
+        self.heap = []
+        for entry in entries:
+            entry.next_run = None
+            entry.generation += 1
+            if not entry.is_paused and entry.cron:
+                offset = self.get_offset(entry)
+                self._push(entry, entry.cron.next_after(now - offset), offset)
+        self._wake()
+
+    def pop_due(self, now: datetime) -> List[CronEntity]:
+        """Pops entries due at now and schedules their next runs. Runs
+        missed e.g. after a forward clock jump are collapsed into one."""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            fire_at, _, entry, generation, offset = heappop(self.heap)
+            if generation != entry.generation or entry.is_paused:
+                continue  # stale heap item
+            run_at = fire_at - offset
+            due.append(entry)
+            self._push(entry, entry.cron.next_after(max(now - offset, run_at)), offset)
+        return due
+
+    def get_delay(self, now: datetime) -> float:
+        if not self.heap:
+            return self.MAX_SLEEP
+        delay = (self.heap[0][0] - now).total_seconds()
+        return max(0.0, min(delay, self.MAX_SLEEP))
+
+    async def run(self):
+        self.is_running = True
+        loop = asyncio.get_running_loop()
+        try:
+            while self.is_running:
+                now = datetime.now()
+                if self._last_now and now < self._last_now:
+                    logger.warning('Clock moved backwards by %s, rescheduling cron',
+                                   self._last_now - now)
+                    self.reschedule(self.entries, now)
+                self._last_now = now
+                for entry in self.pop_due(now):
+                    try:
+                        self.fire(entry)
+                    except Exception:
+                        logger.exception('Cron job (%s) failed', entry.schedule)
+                self._wakeup = loop.create_future()
+                await asyncio.wait([self._wakeup], timeout=self.get_delay(now))
+        finally:
+            self.is_running = False
+
+    def stop(self):
+        self.is_running = False
+        self._wake()
+
+    def _push(self, entry: CronEntity, run_at: Optional[datetime],
+              offset: timedelta):
+        entry.next_run = run_at
+        if run_at:
+            heappush(self.heap, (run_at + offset, next(self._counter), entry,
+                                 entry.generation, offset))
+
+    def _wake(self):
+        if self._wakeup and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+
+class CronAdmission:
+    """Starts cron-launched operations no faster than `rate` per second
+    per exchange, queueing the rest of a burst into later time slots"""
+
+    def __init__(self, start: Callable[[Operation], None], rate: float = 0):
+        self.start = start
+        self.rate = rate
+        self.next_slot: Dict[str, float] = {}
+
+    def submit(self, exchange_id: Optional[str], op: Operation):
+        if not self.rate or not exchange_id:
+            self.start(op)
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        slot = max(now, self.next_slot.get(exchange_id, 0))
+        self.next_slot[exchange_id] = slot + 1 / self.rate
+        if slot <= now:
+            self.start(op)
+        else:
+            loop.call_at(slot, self._start, op)
+
+    def _start(self, op: Operation):
+        try:
+            self.start(op)
+        except Exception:
+            logger.exception('Starting cron job (%s) failed', op.cmd)
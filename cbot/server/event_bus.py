@@ -18,8 +18,11 @@
 """
 
 import asyncio
+from collections import deque
 from enum import Enum
-from typing import Callable
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from cbot.server.logger import logger
 
 
 class Event(Enum):
@@ -39,28 +42,288 @@ class Event(Enum):
     TICKER_UPDATE = 'TICKER_UPDATE'
 
 
+# Events whose payload is a full snapshot of some state, so only the newest
+# one emitted within a coalescing window needs to reach the listeners.
+SNAPSHOT_EVENTS = (
+    Event.CMC_LATEST_UPDATE,
+    Event.STREAM_TICKERS,
+    Event.TICKER_UPDATE,
+)
+
+
+class OverflowPolicy(Enum):
+    BLOCK = 'BLOCK'
+    DROP_OLDEST = 'DROP_OLDEST'
+    COALESCE = 'COALESCE'
+
+
+class ListenerQueue:
+    """Bounded delivery queue drained by a single long-lived consumer task.
+
+    When the queue is full, BLOCK makes `EventBus.emit_wait` wait for room
+    (a synchronous `emit` cannot wait, so the oldest pending event is
+    dropped and counted as an overflow), DROP_OLDEST discards the oldest
+    pending event and COALESCE overwrites the newest pending snapshot
+    event of the same name, falling back to dropping the oldest one.
+    Snapshot events are always put with replace=True, so a listener never
+    has two of them pending.
+    """
+
+    def __init__(self, event_name: Event, listener: Callable,
+                 maxsize: int, policy: OverflowPolicy):
+        self.event_name = event_name
+        self.listener = listener
+        self.maxsize = maxsize
+        self.policy = policy
+        self.queue: Deque[List] = deque()
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.is_closed = False
+        self._latest: Dict[Event, List] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._waiter: Optional[asyncio.Future] = None
+        self._space_waiters: Deque[asyncio.Future] = deque()
+
+    def __repr__(self):
+        return '<ListenerQueue %s %s depth=%d>' % (
+            self.event_name.value, self.listener_name, len(self.queue))
+
+    @property
+    def listener_name(self) -> str:
+        return getattr(self.listener, '__qualname__', repr(self.listener))
+
+    def is_full(self) -> bool:
+        return len(self.queue) >= self.maxsize
+
+    def put(self, event_name: Event, args: tuple, kwargs: dict,
+            replace: bool = False):
+        if self.is_closed:
+            return
+        if replace and event_name in self._latest:
+            item = self._latest[event_name]
+            item[1], item[2] = args, kwargs
+            self.coalesced += 1
+            return
+        if self.is_full():
+            if self.policy is OverflowPolicy.COALESCE and event_name in SNAPSHOT_EVENTS \
+                    and event_name in self._latest:
+                item = self._latest[event_name]
+                item[1], item[2] = args, kwargs
+                self.coalesced += 1
+                return
+            if self.policy is OverflowPolicy.BLOCK:
+                self.overflows += 1
+            self._pop()
+            self.dropped += 1
+        item = [event_name, args, kwargs]
+        self.queue.append(item)
+        self._latest[event_name] = item
+        self._wakeup()
+
+    async def wait_for_space(self):
+        while self.is_full() and not self.is_closed:
+            waiter = asyncio.get_running_loop().create_future()
+            self._space_waiters.append(waiter)
+            await waiter
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'event': self.event_name.value,
+            'listener': self.listener_name,
+            'policy': self.policy.value,
+            'depth': len(self.queue),
+            'maxsize': self.maxsize,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'overflows': self.overflows,
+        }
+
+    def close(self):
+        self.is_closed = True
+        self.queue.clear()
+        self._latest.clear()
+        self._release_space_waiters()
+        if self._task and not self._task.done() \
+                and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def _pop(self) -> List:
+        item = self.queue.popleft()
+        if self._latest.get(item[0]) is item:
+            del self._latest[item[0]]
+        return item
+
+    def _wakeup(self):
+        if self._task is None or self._task.done():
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._consume())
+            except RuntimeError:  # no running loop yet, start on next emit
+                return
+        if self._waiter and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _release_space_waiters(self):
+        while self._space_waiters:
+            waiter = self._space_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while not self.is_closed:
+            if not self.queue:
+                self._waiter = loop.create_future()
+                try:
+                    await self._waiter
+                finally:
+                    self._waiter = None
+                continue
+            event_name, args, kwargs = self._pop()
+            if not self.is_full():
+                self._release_space_waiters()
+            try:
+                if self.event_name is Event.ALL:
+                    await self.listener(event_name, *args, **kwargs)
+                else:
+                    await self.listener(*args, **kwargs)
+            except Exception:
+                logger.exception('Event listener %s failed', self.listener_name)
+            self.delivered += 1
+
+
 class EventBus:
+    DEFAULT_MAXSIZE = 1000
+
     def __init__(self):
-        self.listeners = {}
+        self.listeners: Dict[Event, Dict[Callable, ListenerQueue]] = {}
+        self.coalesce_windows: Dict[Event, float] = {}
+        self.batch_settings: Dict[Event, tuple] = {}
+        self._pending: Dict[Event, tuple] = {}
+        self._batches: Dict[Event, list] = {}
+        self._flush_handles: Dict[Event, tuple] = {}
 
-    def add_listener(self, event_name: Event, listener: Callable):
-        if not self.listeners.get(event_name, None):
-            self.listeners[event_name] = {listener}
-        else:
-            self.listeners[event_name].add(listener)
+    def add_listener(self, event_name: Event, listener: Callable,
+                     maxsize: int = DEFAULT_MAXSIZE,
+                     policy: OverflowPolicy = OverflowPolicy.BLOCK):
+        queues = self.listeners.setdefault(event_name, {})
+        if listener not in queues:
+            queues[listener] = ListenerQueue(event_name, listener, maxsize, policy)
 
     def remove_listener(self, event_name: Event, listener: Callable):
-        self.listeners[event_name].remove(listener)
-        if len(self.listeners[event_name]) == 0:
+        queues = self.listeners[event_name]
+        queues.pop(listener).close()
+        if len(queues) == 0:
             del self.listeners[event_name]
 
+    def set_coalescing(self, event_name: Event, window: Optional[float] = 0):
+        """Collapses emits of a snapshot-style event into a single delivery
+        of the newest payload, once per loop tick (window=0) or once per
+        window seconds. None turns coalescing off."""
+        if window is None:
+            self.coalesce_windows.pop(event_name, None)
+        else:
+            self.coalesce_windows[event_name] = window
+
+    def set_batching(self, event_name: Event, window: Optional[float] = 0.05,
+                     max_size: int = 100):
+        """Delivers the payloads of an event as a single list, once per
+        window seconds or as soon as max_size of them are collected.
+        None turns batching off."""
+        if window is None:
+            self.batch_settings.pop(event_name, None)
+            self._flush_batch(event_name)
+        else:
+            self.batch_settings[event_name] = (window, max_size)
+
     def emit(self, event_name: Event, *args, **kwargs):
-        named_listeners = self.listeners.get(event_name, [])
-        for listener in named_listeners:
-            asyncio.create_task(listener(*args, **kwargs))
-        all_listeners = self.listeners.get(Event.ALL, [])
-        for listener in all_listeners:
-            asyncio.create_task(listener(event_name, *args, **kwargs))
+        if event_name in self.coalesce_windows:
+            self._emit_coalesced(event_name, args, kwargs)
+        elif event_name in self.batch_settings:
+            self._emit_batched(event_name, args[0])
+        else:
+            self._dispatch(event_name, args, kwargs)
+
+    async def emit_wait(self, event_name: Event, *args, **kwargs):
+        """Like emit, but waits for room in BLOCK listener queues"""
+        if event_name in self.coalesce_windows:
+            self._emit_coalesced(event_name, args, kwargs)
+            return
+        if event_name in self.batch_settings:
+            self._emit_batched(event_name, args[0])
+            return
+        for lq in self._get_queues(event_name):
+            if lq.policy is OverflowPolicy.BLOCK:
+                await lq.wait_for_space()
+            lq.put(event_name, args, kwargs)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [lq.stats() for queues in self.listeners.values()
+                for lq in queues.values()]
+
+    def _emit_coalesced(self, event_name: Event, args: tuple, kwargs: dict):
+        self._pending[event_name] = (args, kwargs)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush(event_name)
+            return
+        scheduled = self._flush_handles.get(event_name)
+        if scheduled and scheduled[0] is loop:
+            return
+        window = self.coalesce_windows[event_name]
+        if window > 0:
+            handle = loop.call_later(window, self._flush, event_name)
+        else:
+            handle = loop.call_soon(self._flush, event_name)
+        self._flush_handles[event_name] = (loop, handle)
+
+    def _flush(self, event_name: Event):
+        self._flush_handles.pop(event_name, None)
+        pending = self._pending.pop(event_name, None)
+        if pending:
+            self._dispatch(event_name, *pending)
+
+    def _emit_batched(self, event_name: Event, payload: Any):
+        batch = self._batches.setdefault(event_name, [])
+        batch.append(payload)
+        window, max_size = self.batch_settings[event_name]
+        if len(batch) >= max_size:
+            self._flush_batch(event_name)
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush_batch(event_name)
+            return
+        scheduled = self._flush_handles.get(event_name)
+        if scheduled and scheduled[0] is loop:
+            return
+        handle = loop.call_later(window, self._flush_batch, event_name)
+        self._flush_handles[event_name] = (loop, handle)
+
+    def _flush_batch(self, event_name: Event):
+        scheduled = self._flush_handles.pop(event_name, None)
+        if scheduled:
+            scheduled[1].cancel()
+        batch = self._batches.pop(event_name, None)
+        if batch:
+            self._dispatch(event_name, (batch,), {})
+
+    def _dispatch(self, event_name: Event, args: tuple, kwargs: dict):
+        replace = event_name in self.coalesce_windows
+        for lq in self._get_queues(event_name):
+            lq.put(event_name, args, kwargs, replace)
+
+    def _get_queues(self, event_name: Event) -> List[ListenerQueue]:
+        queues = list(self.listeners.get(event_name, {}).values())
+        queues.extend(self.listeners.get(Event.ALL, {}).values())
+        return queues
 
 
 event_bus = EventBus()
+for _event in SNAPSHOT_EVENTS:
+    event_bus.set_coalescing(_event)
+event_bus.set_batching(Event.LOGGER)
@@ -0,0 +1,83 @@
+"""
+# framing.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+from typing import List, Optional
+
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class FramingError(Exception):
+    pass
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """Prefixes payload with its length as 4 bytes, big-endian"""
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    """Incremental decoder of the TCP control protocol.
+
+    Messages are length-prefixed frames. A peer whose first byte is '{'
+    speaks the legacy protocol instead, one JSON document per line; a
+    valid frame can never start with it, as that would announce a
+    payload of more than MAX_FRAME_SIZE bytes.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.line_mode: Optional[bool] = None
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Adds received bytes, returns the messages completed by them"""
+        self.buffer += data
+        if self.line_mode is None and self.buffer:
+            self.line_mode = self.buffer[:1] == b'{'
+        messages = []
+        while True:
+            message = self._next_line() if self.line_mode else self._next_frame()
+            if message is None:
+                return messages
+            if message:
+                messages.append(message)
+
+    def _next_line(self) -> Optional[bytes]:
+        end = self.buffer.find(b'\n')
+        if end < 0:
+            if len(self.buffer) > MAX_FRAME_SIZE:
+                raise FramingError('Line too long')
+            return None
+        line = bytes(self.buffer[:end]).strip()
+        del self.buffer[:end + 1]
+        return line
+
+    def _next_frame(self) -> Optional[bytes]:
+        if len(self.buffer) < HEADER.size:
+            return None
+        size = HEADER.unpack_from(self.buffer)[0]
+        if size > MAX_FRAME_SIZE:
+            raise FramingError('Frame too large: %d bytes' % size)
+        end = HEADER.size + size
+        if len(self.buffer) < end:
+            return None
+        frame = bytes(self.buffer[HEADER.size:end])
+        del self.buffer[:end]
+        return frame
@@ -0,0 +1,274 @@
+"""
+# ifttt.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import ast
+import builtins
+from bisect import bisect_left, bisect_right
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from cbot.server.operation import Operation
+
+# A (exchange, symbol) pair read by a condition; symbol is None when the
+# condition reads the exchange's ticker board as a whole.
+TickerRef = Tuple[str, Optional[str]]
+
+# (exchange, symbol, operator, price level) of a condition in the simple
+# form binance['BTC/USDT']['last'] > 50000
+PriceTrigger = Tuple[str, str, str, float]
+
+COMPARE_OPS = {
+    ast.Gt: '>',
+    ast.GtE: '>=',
+    ast.Lt: '<',
+    ast.LtE: '<=',
+}
+SWAPPED_OPS = {
+    '>': '<',
+    '>=': '<=',
+    '<': '>',
+    '<=': '>=',
+}
+
+
+def parse_refs(tree: ast.AST) -> Set[TickerRef]:
+    """Collects tickers referenced by a condition such as
+    binance['BTC/USDT']['last'] > 50000"""
+    refs = set()
+    subscripted = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) \
+                and isinstance(node.slice, ast.Constant) \
+                and isinstance(node.slice.value, str):
+            refs.add((node.value.id, node.slice.value))
+            subscripted.add(id(node.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and id(node) not in subscripted \
+                and not hasattr(builtins, node.id):
+            refs.add((node.id, None))
+    return refs
+
+
+def _parse_last_price(node: ast.AST) -> Optional[Tuple[str, str]]:
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+            and node.func.id == 'float' and len(node.args) == 1 and not node.keywords:
+        node = node.args[0]
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant) \
+            and node.slice.value == 'last':
+        ticker = node.value
+        if isinstance(ticker, ast.Subscript) and isinstance(ticker.value, ast.Name) \
+                and isinstance(ticker.slice, ast.Constant) \
+                and isinstance(ticker.slice.value, str):
+            return ticker.value.id, ticker.slice.value
+    return None
+
+
+def _parse_number(node: ast.AST) -> Optional[float]:
+    sign = 1
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        sign = -1 if isinstance(node.op, ast.USub) else 1
+        node = node.operand
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return sign * float(node.value)
+    return None
+
+
+def parse_price_trigger(tree: ast.Expression) -> Optional[PriceTrigger]:
+    """Recognizes single "last price vs constant" comparisons"""
+    node = tree.body
+    if not isinstance(node, ast.Compare) or len(node.ops) != 1 \
+            or type(node.ops[0]) not in COMPARE_OPS:
+        return None
+    op = COMPARE_OPS[type(node.ops[0])]
+    left, right = node.left, node.comparators[0]
+    ticker, level = _parse_last_price(left), _parse_number(right)
+    if ticker is None or level is None:
+        ticker, level = _parse_last_price(right), _parse_number(left)
+        op = SWAPPED_OPS[op]
+    if ticker is None or level is None:
+        return None
+    return ticker[0], ticker[1], op, level
+
+
+class PriceTriggers:
+    """Threshold triggers of a single symbol, kept sorted by price level.
+
+    Triggered entries are removed from the index once they run, so for
+    every tick the satisfied triggers are exactly the ones crossed since
+    the previous price, found with a bisect in O(log n + k).
+    """
+
+    def __init__(self):
+        self.levels: Dict[str, List[float]] = {op: [] for op in SWAPPED_OPS}
+        self.entries: Dict[str, List[Any]] = {op: [] for op in SWAPPED_OPS}
+
+    def __len__(self):
+        return sum(map(len, self.levels.values()))
+
+    def add(self, op: str, level: float, entry: Any):
+        levels = self.levels[op]
+        pos = bisect_right(levels, level)
+        levels.insert(pos, level)
+        self.entries[op].insert(pos, entry)
+
+    def remove(self, op: str, level: float, entry: Any):
+        levels, entries = self.levels[op], self.entries[op]
+        pos = bisect_left(levels, level)
+        while pos < len(levels) and levels[pos] == level:
+            if entries[pos] is entry:
+                del levels[pos]
+                del entries[pos]
+                return
+            pos += 1
+
+    def crossed(self, price: float) -> List[Any]:
+        levels, entries = self.levels, self.entries
+        res = entries['>'][:bisect_left(levels['>'], price)]
+        res += entries['>='][:bisect_right(levels['>='], price)]
+        res += entries['<'][bisect_right(levels['<'], price):]
+        res += entries['<='][bisect_left(levels['<='], price):]
+        return res
+
+
+def get_last_price(tickers: Dict, ref: TickerRef) -> Optional[float]:
+    try:
+        return float(tickers[ref[0]][ref[1]]['last'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class IftttEntity:
+    condition: str
+    op: Operation
+    is_paused: bool = False
+
+    def __init__(self, condition: str, op: Operation, is_paused: bool = False):
+        self.condition = condition
+        self.op = op
+        self.is_paused = is_paused
+        self.code = None
+        self.refs: Set[TickerRef] = set()
+        self.trigger: Optional[PriceTrigger] = None
+        self.compile()
+
+    def __str__(self):
+        return f'{self.condition} {self.op}{" (paused)" if self.is_paused else ""}'
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('code', None)  # code objects cannot be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.code = None
+        self.refs = set()
+        self.trigger = None
+        try:
+            self.compile()
+        except SyntaxError:
+            pass  # evaluate() will raise and the entry gets dropped
+
+    def compile(self):
+        tree = ast.parse(self.condition, mode='eval')
+        self.code = compile(tree, '<ifttt>', 'eval')
+        self.refs = parse_refs(tree)
+        self.trigger = parse_price_trigger(tree)
+
+    def evaluate(self, tickers: Dict) -> bool:
+        if self.code is None:
+            raise SyntaxError(f'Invalid condition: {self.condition}')
+        return eval(self.code, {}, tickers)  # pylint: disable=eval-used
+
+
+class IftttIndex:
+    """Maps tickers to the IFTTT entries whose conditions read them.
+    Simple price thresholds go to a per-symbol PriceTriggers instead."""
+
+    def __init__(self):
+        self.by_price: Dict[TickerRef, PriceTriggers] = {}
+        self.by_symbol: Dict[TickerRef, Set[IftttEntity]] = {}
+        self.by_exchange: Dict[str, Set[IftttEntity]] = {}
+        self.unindexed: Set[IftttEntity] = set()
+        self.order: Dict[IftttEntity, int] = {}
+        self._counter = count()
+
+    def __len__(self):
+        return len(self.order)
+
+    def add(self, entry: IftttEntity):
+        self.order[entry] = next(self._counter)
+        if entry.trigger:
+            exchange, symbol, op, level = entry.trigger
+            self.by_price.setdefault((exchange, symbol), PriceTriggers()).add(op, level, entry)
+            return
+        if not entry.refs:
+            self.unindexed.add(entry)
+        for exchange, symbol in entry.refs:
+            if symbol is None:
+                self.by_exchange.setdefault(exchange, set()).add(entry)
+            else:
+                self.by_symbol.setdefault((exchange, symbol), set()).add(entry)
+
+    def remove(self, entry: IftttEntity):
+        if self.order.pop(entry, None) is None:
+            return
+        if entry.trigger:
+            exchange, symbol, op, level = entry.trigger
+            triggers = self.by_price.get((exchange, symbol))
+            if triggers is not None:
+                triggers.remove(op, level, entry)
+                if not triggers:
+                    del self.by_price[(exchange, symbol)]
+            return
+        self.unindexed.discard(entry)
+        for exchange, symbol in entry.refs:
+            if symbol is None:
+                self._discard(self.by_exchange, exchange, entry)
+            else:
+                self._discard(self.by_symbol, (exchange, symbol), entry)
+
+    def clear(self):
+        self.__init__()
+
+    def lookup(self, changed: Iterable[TickerRef],
+               tickers: Optional[Dict] = None) -> List[IftttEntity]:
+        """Returns entries affected by the changed tickers, in insertion order.
+        Price triggers are only returned once crossed, which needs tickers."""
+        entries = set(self.unindexed)
+        exchanges = set()
+        for ref in changed:
+            exchanges.add(ref[0])
+            entries.update(self.by_symbol.get(ref, ()))
+            triggers = self.by_price.get(ref)
+            if triggers and tickers:
+                price = get_last_price(tickers, ref)
+                if price is not None:
+                    entries.update(triggers.crossed(price))
+        for exchange in exchanges:
+            entries.update(self.by_exchange.get(exchange, ()))
+        return sorted(entries, key=self.order.__getitem__)
+
+    @staticmethod
+    def _discard(index: Dict, key, entry: IftttEntity):
+        entries = index.get(key)
+        if entries is not None:
+            entries.discard(entry)
+            if not entries:
+                del index[key]
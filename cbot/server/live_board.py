@@ -0,0 +1,84 @@
+"""
+# live_board.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional
+
+
+class LiveBoard:
+    """bin_live leaderboard kept sorted by the SORT_BY change.
+
+    An update returns a BIN_LIVE_UPDATE delta with the changed row and,
+    when its rank changed, a [symbol, rank] move. Clients apply deltas in
+    version order; every KEYFRAME_INTERVAL seconds the whole board is
+    sent instead, which also lets a client that missed a delta recover.
+    """
+
+    SORT_BY = '5m'
+    KEYFRAME_INTERVAL = 30
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self.keys: List[Any] = []  # negated SORT_BY values, ascending
+        self.by_symbol: Dict[str, Dict[str, Any]] = {}
+        self.version = 0
+        self.last_keyframe: Optional[float] = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def update(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        symbol = row['s']
+        old_rank = self._remove(symbol)
+        key = -row[self.SORT_BY]
+        rank = bisect_right(self.keys, key)
+        self.rows.insert(rank, row)
+        self.keys.insert(rank, key)
+        self.by_symbol[symbol] = row
+        self.version += 1
+
+        now = time.monotonic()
+        if self.last_keyframe is None or now - self.last_keyframe >= self.KEYFRAME_INTERVAL:
+            return self.keyframe()
+        return {
+            'version': self.version,
+            'full': False,
+            'rows': [row],
+            'moves': [[symbol, rank]] if rank != old_rank else [],
+        }
+
+    def keyframe(self) -> Dict[str, Any]:
+        self.last_keyframe = time.monotonic()
+        return {
+            'version': self.version,
+            'full': True,
+            'rows': list(self.rows),
+        }
+
+    def _remove(self, symbol: str) -> Optional[int]:
+        old = self.by_symbol.pop(symbol, None)
+        if old is None:
+            return None
+        i = bisect_left(self.keys, -old[self.SORT_BY])
+        while self.rows[i] is not old:
+            i += 1
+        del self.rows[i]
+        del self.keys[i]
+        return i
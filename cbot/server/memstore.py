@@ -17,7 +17,8 @@
 # with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from typing import Any
+from collections import OrderedDict
+from typing import Any, List, Tuple
 
 from cbot.server.event_bus import event_bus, Event
 
@@ -30,6 +31,8 @@ class MemStore:
             'ohlcv': {},
             'tickers': {},
         }
+        self.ticker_seq = 0
+        self.ticker_changes: OrderedDict[Tuple[str, str], int] = OrderedDict()
 
     def __repr__(self):
         return str(self.__dict__)
@@ -53,6 +56,9 @@ class MemStore:
             self.store['tickers'][exchange] = {}
         key = ticker['symbol']
         self.store['tickers'][exchange][key] = ticker
+        self.ticker_seq += 1
+        self.ticker_changes[(exchange, key)] = self.ticker_seq
+        self.ticker_changes.move_to_end((exchange, key))
         event_bus.emit(Event.TICKER_UPDATE, self.store['tickers'])
 
     def get(self, key: str, default: Any = None):
@@ -66,6 +72,16 @@ class MemStore:
     def get_ticker(self, exchange: str, key: str, default: Any = None):
         self.store['tickers'][exchange].get(key, default)
 
+    def get_changed_tickers(self, since: int) -> Tuple[int, List[Tuple[str, str]]]:
+        """Returns the current ticker sequence number and the (exchange, symbol)
+        pairs updated after the `since` sequence number"""
+        changed = []
+        for key in reversed(self.ticker_changes):
+            if self.ticker_changes[key] <= since:
+                break
+            changed.append(key)
+        return self.ticker_seq, changed
+
     def to_savegame(self):
         return self.store
 
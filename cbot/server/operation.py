@@ -17,10 +17,19 @@
 # with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from typing import Any
+from typing import Any, Dict, Iterator, List, Optional
+
+from cbot.server import serializer
 
 
 class Operation:
+    STREAM_CHUNK = 500
+
+    # pre-encoded JSON items of a list used in place of `data` when set
+    data_json_items: Optional[List[str]] = None
+    # client supplied id, echoed back in the response
+    request_id: Any = None
+
     def __init__(self, cmd: str = None, args=None, kwargs=None):
         self.cmd: str = cmd
         self.args = args or []
@@ -35,15 +44,31 @@ class Operation:
     def __str__(self):
         return str(self.__dict__)
 
+    def set_error(self, exc: Exception):
+        """Turns the operation into an ERR response for exc"""
+        self.resp_code = 'ERR'
+        self.output = 'ERR: %s' % exc
+        self.data = None
+        self.data_json_items = None
+
+    @property
+    def data_json(self) -> Optional[str]:
+        if self.data_json_items is None:
+            return None
+        return '[' + ','.join(self.data_json_items) + ']'
+
     def to_response(self):
-        return {
+        res = {
             'resp_code': self.resp_code,
             'output': self.output,
             'data': self.data,
         }
+        if self.request_id is not None:
+            res['id'] = self.request_id
+        return res
 
     def to_stream_response(self):
-        return {
+        res = {
             'stream': 'RESULT',
             'data': {
                 'cmd': self.cmd,
@@ -52,3 +77,62 @@ class Operation:
                 'data': self.data,
             }
         }
+        if self.request_id is not None:
+            res['data']['id'] = self.request_id
+        return res
+
+    def to_response_json(self) -> str:
+        return self._encode(self.to_response())
+
+    def iter_response_json(self, chunk_size: int = STREAM_CHUNK) -> Iterator[str]:
+        """Yields the response in parts, see iter_responses. Pre-encoded
+        items are split up the same way, without being decoded"""
+        items = self.data_json_items
+        if items is None:
+            for res in self.iter_responses(chunk_size):
+                yield serializer.dumps(res)
+            return
+        if len(items) <= chunk_size:
+            yield self.to_response_json()
+            return
+        res = self.to_response()
+        for start in range(0, len(items), chunk_size):
+            res['more'] = start + chunk_size < len(items)
+            yield self._encode(res, '[' + ','.join(items[start:start + chunk_size]) + ']')
+            res = {} if self.request_id is None else {'id': self.request_id}
+
+    def iter_responses(self, chunk_size: int = STREAM_CHUNK) -> Iterator[Dict]:
+        """Yields the response in parts: a list `data` longer than
+        chunk_size is split up, parts after the first carry only `data`
+        and `id`, and all but the last one have "more": true. Any other
+        data, e.g. a dict, is sent in one part"""
+        res = self.to_response()
+        data = self.get_data()
+        if not isinstance(data, list) or len(data) <= chunk_size:
+            res['data'] = data
+            yield res
+            return
+        for start in range(0, len(data), chunk_size):
+            res['data'] = data[start:start + chunk_size]
+            res['more'] = start + chunk_size < len(data)
+            yield res
+            res = {} if self.request_id is None else {'id': self.request_id}
+
+    def get_data(self) -> Any:
+        """Returns data, decoding data_json when it is set"""
+        if self.data_json is not None:
+            return serializer.loads(self.data_json)
+        return self.data
+
+    def to_stream_response_json(self) -> str:
+        if self.data_json is None:
+            return serializer.dumps(self.to_stream_response())
+        return '{"stream":"RESULT","data":%s}' % \
+               self._encode(self.to_stream_response()['data'])
+
+    def _encode(self, res: Dict, data_json: str = None) -> str:
+        data_json = data_json or self.data_json
+        if data_json is None:
+            return serializer.dumps(res)
+        res.pop('data', None)
+        return serializer.dumps(res)[:-1] + ',"data":' + data_json + '}'
@@ -0,0 +1,84 @@
+"""
+# ring_buffer.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Any, Dict, Iterable, Iterator, List
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of task output lines.
+
+    Every appended line gets a `seq` number, increasing by one per line
+    and never reused, so clients can ask for the lines after the last one
+    they have seen even when older lines were already overwritten.
+    """
+
+    def __init__(self, capacity: int, lines: Iterable[Dict] = ()):
+        self.capacity = capacity
+        self.lines: List[Dict] = []
+        self.start = 0  # physical index of the oldest line
+        self.seq = 0  # seq of the newest line
+        for line in lines:
+            if 'seq' in line:
+                self.seq = line['seq'] - 1
+            self.append(line)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.tail())
+
+    def __reversed__(self) -> Iterator[Dict]:
+        """Iterates from the newest line without copying the buffer"""
+        size = len(self.lines)
+        for i in range(size - 1, -1, -1):
+            yield self.lines[(self.start + i) % size]
+
+    @property
+    def first_seq(self) -> int:
+        return self.seq - len(self.lines) + 1
+
+    def append(self, line: Dict[str, Any]):
+        self.seq += 1
+        line['seq'] = self.seq
+        if len(self.lines) < self.capacity:
+            self.lines.append(line)
+        else:
+            self.lines[self.start] = line
+            self.start = (self.start + 1) % self.capacity
+
+    def tail(self, num: int = None) -> List[Dict]:
+        """Returns the newest num lines, all of them if num is not given"""
+        size = len(self.lines)
+        if not num or num > size:
+            num = size
+        return self._from_offset(size - num)
+
+    def since(self, seq: int, num: int = None) -> List[Dict]:
+        """Returns the lines newer than seq, at most num of the oldest ones"""
+        offset = max(seq - self.first_seq + 1, 0)
+        res = self._from_offset(offset) if offset < len(self.lines) else []
+        return res[:num] if num else res
+
+    def _from_offset(self, offset: int) -> List[Dict]:
+        pos = self.start + offset
+        if pos >= len(self.lines):
+            pos -= len(self.lines)
+            return self.lines[pos:self.start]
+        return self.lines[pos:] + self.lines[:self.start]
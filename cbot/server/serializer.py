@@ -0,0 +1,101 @@
+"""
+# serializer.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BACKENDS = ('json', 'orjson')
+
+
+def default(o: Any) -> Any:
+    """Encodes the types JSON has no notion of, for all backends"""
+    if isinstance(o, Decimal):
+        return str(o)
+    if isinstance(o, Enum):
+        return o.value
+    if isinstance(o, (datetime, date, time)):
+        return str(o)  # as json.dumps(default=str) always did
+    to_info_dict = getattr(o, 'to_info_dict', None)  # Task
+    if to_info_dict:
+        return to_info_dict()
+    if isinstance(o, (set, frozenset)):
+        return list(o)
+    return str(o)  # CronEntity, IftttEntity and anything else
+
+
+def json_dumps(obj: Any) -> str:
+    return json.dumps(obj, default=default, separators=(',', ':'))
+
+
+def orjson_dumps(obj: Any) -> str:
+    try:
+        return orjson.dumps(obj, default=default,
+                            option=orjson.OPT_NON_STR_KEYS |
+                            orjson.OPT_PASSTHROUGH_DATETIME).decode()
+    except TypeError:  # e.g. integers over 64 bits
+        return json_dumps(obj)
+
+
+def packb(obj: Any) -> bytes:
+    """Encodes obj as msgpack, with the same type conversions as JSON"""
+    return msgpack.packb(obj, default=default, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+# rebound by use_backend, hence not constants
+# pylint: disable=invalid-name
+dumps: Callable[[Any], str] = json_dumps
+loads: Callable[[Any], Any] = json.loads
+backend = 'json'
+
+
+def use_backend(name: str = None):
+    """Selects the encoder, orjson when it is installed by default"""
+    global dumps, loads, backend  # pylint: disable=global-statement
+    if name is None:
+        name = 'orjson' if orjson else 'json'
+    if name not in BACKENDS:
+        raise ValueError('Unknown JSON backend: %s' % name)
+    if name == 'orjson' and not orjson:
+        raise ValueError('orjson is not installed')
+    if name == 'orjson':
+        dumps, loads = orjson_dumps, orjson.loads
+    else:
+        dumps, loads = json_dumps, json.loads
+    backend = name
+# pylint: enable=invalid-name
+
+
+use_backend()
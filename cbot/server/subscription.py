@@ -0,0 +1,131 @@
+"""
+# subscription.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from cbot.server.event_bus import Event
+
+FILTER_KEYS = ('taskId', 'symbol')
+
+
+def _get_field(item: Any, key: str) -> Any:
+    if not isinstance(item, dict):
+        return None
+    if key in item:
+        return item[key]
+    if key == 'symbol' and 's' in item:
+        return item['s']
+    nested = item.get('data')
+    if isinstance(nested, dict):
+        return nested.get(key)
+    return None
+
+
+class Subscription:
+    """Events a single client wants to receive.
+
+    A new subscription receives every event. The first subscribe narrows
+    it down to the given events only. An event can be limited to items
+    matching a taskId or symbol, list payloads are then reduced to the
+    matching items.
+    """
+
+    def __init__(self):
+        self.all_events = True
+        self.excluded: Set[Event] = set()
+        self.topics: Dict[Event, Optional[Dict[str, Set[str]]]] = {}
+
+    def __repr__(self):
+        if self.all_events:
+            return 'ALL'
+        return ', '.join(sorted(e.value for e in self.topics))
+
+    def subscribe(self, event_names: Iterable[str], filters: Dict[str, Any] = None):
+        events = [Event(name) for name in event_names]
+        parsed = None
+        if filters:
+            parsed = {}
+            for key, value in filters.items():
+                if key not in FILTER_KEYS:
+                    raise ValueError('Unknown filter: %s' % key)
+                values = value if isinstance(value, (list, tuple)) else str(value).split(',')
+                parsed[key] = set(map(str, values))
+        if self.all_events and Event.ALL not in events:
+            self.all_events = False
+            self.topics.clear()
+        for event_name in events:
+            if event_name is Event.ALL:
+                self.all_events = True
+                self.excluded.clear()
+            else:
+                self.topics[event_name] = parsed
+                self.excluded.discard(event_name)
+
+    def unsubscribe(self, event_names: Iterable[str]):
+        for event_name in map(Event, event_names):
+            if event_name is Event.ALL:
+                self.all_events = False
+                self.topics.clear()
+            elif self.all_events:
+                self.excluded.add(event_name)
+            self.topics.pop(event_name, None)
+
+    def wants(self, event_name: Event) -> bool:
+        if event_name in self.topics:
+            return True
+        return self.all_events and event_name not in self.excluded
+
+    def select(self, event_name: Event, data: Any) -> Tuple[Any, Any]:
+        """Returns a (key, data) pair with the part of data this client
+        wants, data is None when the event should be skipped. Clients
+        with equal keys get equal data, so it can be encoded once."""
+        if event_name in self.topics:
+            filters = self.topics[event_name]
+        elif self.all_events and event_name not in self.excluded:
+            filters = None
+        else:
+            return None, None
+        if not filters:
+            return None, data
+        key = tuple(sorted((k, tuple(sorted(v))) for k, v in filters.items()))
+        if event_name is Event.TICKER_UPDATE and 'symbol' in filters:
+            symbols = filters['symbol']
+            data = {exchange: {s: t for s, t in tickers.items() if s in symbols}
+                    for exchange, tickers in data.items()}
+            return key, data if any(data.values()) else None
+        if event_name is Event.BIN_LIVE_UPDATE and 'symbol' in filters:
+            # keep the delta, even if empty, so its version is not skipped;
+            # moves hold ranks in the full board, so they are dropped and
+            # the client sorts the rows itself
+            symbols = filters['symbol']
+            data = dict(data, rows=[r for r in data['rows'] if r['s'] in symbols])
+            data.pop('moves', None)
+            return key, data
+        if isinstance(data, list):
+            data = [item for item in data if self._matches(item, filters)]
+            return key, data or None
+        return key, data if self._matches(data, filters) else None
+
+    @staticmethod
+    def _matches(item: Any, filters: Dict[str, Set[str]]) -> bool:
+        for key, values in filters.items():
+            value = _get_field(item, key)
+            if value is None or str(value) not in values:
+                return False
+        return True
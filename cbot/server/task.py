@@ -21,11 +21,14 @@ import time
 import asyncio
 import datetime
 from contextlib import suppress
+from enum import Enum
 from typing import Optional, Callable, Dict, Any
 
+from cbot.server import serializer
 from cbot.server.event_bus import Event, event_bus
 from cbot.server.logger import logger
 from cbot.server.operation import Operation
+from cbot.server.ring_buffer import RingBuffer
 from cbot.server.tasks.data import TaskData
 
 
@@ -37,6 +40,12 @@ async def catch(awaitable):
         logger.exception('Exception')
 
 
+class TaskState(Enum):
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    FINISHED = 'finished'
+
+
 class TaskInfo:
     id: int = 0
     name: str = ''
@@ -63,10 +72,13 @@ class Task:
         self.name = name
         self.is_finished = False
         self.is_paused = False
-        self.output = []
+        self.output = RingBuffer(self.MAX_OUTPUT_LINES)
         self.op = op
         self.start_time = datetime.datetime.now()
         self.data: Optional[TaskData] = None
+        self.on_state_change: Optional[Callable[['Task'], None]] = None
+        self._info: Optional[Dict] = None
+        self._info_json: Optional[str] = None
         if task_info:
             self.from_savegame(task_info)
         if not self.is_finished:
@@ -87,16 +99,29 @@ class Task:
     def __str__(self):
         return self.__repr__()
 
+    @property
+    def state(self) -> TaskState:
+        if self.is_finished:
+            return TaskState.FINISHED
+        if self.is_paused:
+            return TaskState.PAUSED
+        return TaskState.RUNNING
+
     def to_info_dict(self, full=False) -> Any:
-        res = {
-            'id': self.id,
-            'name': self.name,
-            'start_time': int(datetime.datetime.timestamp(self.start_time)),
-            'is_paused': self.is_paused,
-            'is_finished': self.is_finished,
-            'desc': self.op.kwargs.get('desc'),
-        }
+        """The summary dict is cached until invalidate_info() is called,
+        callers must not modify it"""
+        if self._info is None:
+            self._info = {
+                'id': self.id,
+                'name': self.name,
+                'start_time': int(datetime.datetime.timestamp(self.start_time)),
+                'is_paused': self.is_paused,
+                'is_finished': self.is_finished,
+                'desc': self.op.kwargs.get('desc'),
+            }
+        res = self._info
         if full:
+            res = dict(res)
             res.update({
                 'op': self.op.__dict__,
                 # 'output': self.output, # FIXME
@@ -104,13 +129,22 @@ class Task:
             })
         return res
 
+    def to_info_json(self) -> str:
+        if self._info_json is None:
+            self._info_json = serializer.dumps(self.to_info_dict())
+        return self._info_json
+
+    def invalidate_info(self):
+        self._info = None
+        self._info_json = None
+
     def to_savegame(self) -> TaskInfo:
         info = TaskInfo()
         info.id = self.id
         info.name = self.name
         info.is_finished = self.is_finished
         info.is_paused = self.is_paused
-        info.output = self.output
+        info.output = self.output.tail()
         info.op = self.op
         info.data = self.data
         info.start_time = self.start_time
@@ -120,17 +154,17 @@ class Task:
         self.id = info.id
         self.is_finished = info.is_finished
         self.is_paused = info.is_paused
-        self.output = info.output
+        self.output = RingBuffer(self.MAX_OUTPUT_LINES, info.output)
         self.start_time = info.start_time
         self.data = info.data
+        self.invalidate_info()
 
-    def _printer(self, *args) -> str:
-        if len(self.output) >= self.MAX_OUTPUT_LINES:
-            self.output = self.output[-self.MAX_OUTPUT_LINES:]  # n-last elements
+    def _printer(self, *args, level: str = 'info') -> str:
         str_args = ' '.join(map(str, args))
         out = {
             'ts': time.time(),
             'taskId': self.id,
+            'level': level,
             'msg': str_args,
         }
         self.output.append(out)
@@ -143,19 +177,19 @@ class Task:
         return str_args
 
     def printer_warning(self, *args) -> str:
-        str_args = self._printer(*args)
+        str_args = self._printer(*args, level='warning')
         logger.warning(str_args)
         return str_args
 
     def printer_error(self, *args) -> str:
-        str_args = self._printer(*args)
+        str_args = self._printer(*args, level='error')
         logger.error(str_args)
         return str_args
 
-    def get_output(self, num: int = None):
-        if num:  # get latest num entries
-            return self.output[-num:]  # pylint: disable=E1130
-        return self.output
+    def get_output(self, num: int = None, since: int = None):
+        if since is not None:  # tail from the given seq
+            return self.output.since(since, num)
+        return self.output.tail(num)
 
     def get_info(self) -> Any:
         info = self.to_info_dict(full=True)
@@ -173,21 +207,30 @@ class Task:
 
     def set_finished(self):
         self.is_finished = True
+        self._state_changed()
         event_bus.emit(Event.TASK_FINISHED, {
             'taskId': self.id
         })
 
     def pause(self) -> str:
         self.is_paused = not self.is_paused
+        self._state_changed()
         logger.info('%s task #%d',
                     'Pausing' if self.is_paused else 'Unpausing', self.id)
         return 'OK'
 
     def modify_data(self, kwargs: Dict) -> str:
         self.op.kwargs = kwargs
+        self.invalidate_info()
         if self.data:
             self.data.map_options(None, kwargs)
         event_bus.emit(Event.TASK_MODIFIED, {
             'taskId': self.id
         })
         return 'OK'
+
+    def _state_changed(self):
+        self.invalidate_info()
+        callback = self.on_state_change
+        if callback:
+            callback(self)  # pylint: disable=not-callable
@@ -0,0 +1,131 @@
+"""
+# task_list.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+from cbot.server import serializer
+from cbot.server.event_bus import event_bus, Event
+
+
+class TaskListModel:
+    """Versioned view of the task, cron and IFTTT lists.
+
+    Changes are collected for DEBOUNCE seconds and emitted as a single
+    TASK_MANAGER diff with the added, changed and removed tasks. A client
+    applies diffs in version order and asks for a full snapshot whenever it
+    (re)subscribes or notices a gap.
+    """
+
+    DEBOUNCE = 0.05
+
+    def __init__(self, task_manager: Any):
+        self.task_manager = task_manager
+        self.version = 0
+        self.sent: Dict[int, Dict] = {}
+        self.dirty: Set[int] = set()
+        self.lists_dirty = False
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def mark(self, task_id: int):
+        self.dirty.add(task_id)
+        self._schedule()
+
+    def mark_task(self, task: Any):
+        self.mark(task.id)
+
+    def mark_lists(self):
+        self.lists_dirty = True
+        self._schedule()
+
+    def get_lists(self) -> Dict[str, Any]:
+        return {
+            'cron_list': list(map(str, self.task_manager.cron_list)),
+            'ifttt_list': list(map(str, self.task_manager.ifttt_list)),
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        self.flush()
+        res = {
+            'version': self.version,
+            'full': True,
+            'tasks': list(self.sent.values()),
+        }
+        res.update(self.get_lists())
+        return res
+
+    def snapshot_json(self) -> str:
+        """Same as snapshot(), assembled from the tasks' cached JSON"""
+        self.flush()
+        head = {
+            'version': self.version,
+            'full': True,
+        }
+        head.update(self.get_lists())
+        tasks = ','.join(self.task_manager.tasks.get(task_id).to_info_json()
+                         for task_id in self.sent)
+        return serializer.dumps(head)[:-1] + ',"tasks":[' + tasks + ']}'
+
+    def flush(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        added, changed, removed = [], [], []
+        for task_id in sorted(self.dirty):
+            task = self.task_manager.tasks.get(task_id)
+            if task is None:
+                if self.sent.pop(task_id, None) is not None:
+                    removed.append(task_id)
+                continue
+            info = task.to_info_dict()
+            old_info = self.sent.get(task_id)
+            if old_info is None:
+                added.append(info)
+            elif old_info is not info and old_info != info:
+                changed.append(info)
+            self.sent[task_id] = info
+        self.dirty.clear()
+        if not (added or changed or removed or self.lists_dirty):
+            return
+        self.version += 1
+        diff = {
+            'version': self.version,
+            'full': False,
+            'added': added,
+            'changed': changed,
+            'removed': removed,
+        }
+        if self.lists_dirty:
+            diff.update(self.get_lists())
+            self.lists_dirty = False
+        event_bus.emit(Event.TASK_MANAGER, diff)
+
+    def _schedule(self):
+        if self._handle:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self._handle = loop.call_later(self.DEBOUNCE, self._flush_later)
+
+    def _flush_later(self):
+        self._handle = None
+        self.flush()
@@ -17,130 +17,178 @@
 # with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import asyncio
-import json
+import heapq
 import pprint
 import shlex
 from datetime import datetime
 from importlib import import_module, reload
-from typing import Dict, List, Any
-
-import pycron
+from itertools import islice, takewhile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 from cbot import VERSION
-from cbot.server import mail
+from cbot.server import config, mail, serializer
+from cbot.server.cron import CronAdmission, CronEntity, CronScheduler
 from cbot.server.memstore import memstore
-from cbot.server.event_bus import event_bus, Event
+from cbot.server.event_bus import event_bus, Event, OverflowPolicy
+from cbot.server.ifttt import IftttEntity, IftttIndex
 from cbot.server.logger import logger
 from cbot.server.operation import Operation
-from cbot.server.periodic import Periodic, PeriodicRunStatus
-from cbot.server.task import Task, TaskInfo
+from cbot.server.task import Task, TaskInfo, TaskState
+from cbot.server.task_list import TaskListModel
 from cbot.server.utils import get_timestamp
 
 RESP_OK = 'OK'
 RESP_ERR = 'ERR'
 
 
-class CronEntity:
-    schedule: str
-    op: Operation
-    is_paused: bool = False
+class TaskIndex:
+    """Tasks keyed by id, with secondary indexes by job name and state.
+    Dicts keep insertion order, so iterating gives the task list order."""
 
-    def __init__(self, schedule: str, op: Operation, is_paused: bool = False):
-        self.schedule = schedule
-        self.op = op
-        self.is_paused = is_paused
+    def __init__(self, on_change: Callable[[Task], None] = None):
+        self.on_change = on_change
+        self.by_id: Dict[int, Task] = {}
+        self.by_name: Dict[str, Dict[int, Task]] = {}
+        self.by_state: Dict[TaskState, Dict[int, Task]] = {state: {} for state in TaskState}
+        self._states: Dict[int, TaskState] = {}
 
-    def __str__(self):
-        return f'{self.schedule} {self.op}{" (paused)" if self.is_paused else ""}'
+    def __len__(self):
+        return len(self.by_id)
 
+    def __iter__(self) -> Iterator[Task]:
+        return iter(list(self.by_id.values()))
 
-class IftttEntity:
-    condition: str
-    op: Operation
-    is_paused: bool = False
+    def get(self, task_id: int) -> Optional[Task]:
+        return self.by_id.get(task_id)
 
-    def __init__(self, condition: str, op: Operation, is_paused: bool = False):
-        self.condition = condition
-        self.op = op
-        self.is_paused = is_paused
+    def last(self) -> Optional[Task]:
+        return next(reversed(self.by_id.values()), None)
 
-    def __str__(self):
-        return f'{self.condition} {self.op}{" (paused)" if self.is_paused else ""}'
+    def add(self, task: Task):
+        self.by_id[task.id] = task
+        self.by_name.setdefault(task.name, {})[task.id] = task
+        self._states[task.id] = task.state
+        self.by_state[task.state][task.id] = task
+        task.on_state_change = self.update_state
+
+    def remove(self, task: Task):
+        task.on_state_change = None
+        del self.by_id[task.id]
+        named = self.by_name[task.name]
+        del named[task.id]
+        if not named:
+            del self.by_name[task.name]
+        del self.by_state[self._states.pop(task.id)][task.id]
+
+    def update_state(self, task: Task):
+        old_state = self._states.get(task.id)
+        if old_state is None or old_state is task.state:
+            return
+        del self.by_state[old_state][task.id]
+        self.by_state[task.state][task.id] = task
+        self._states[task.id] = task.state
+        if self.on_change:
+            self.on_change(task)
+
+    def select(self, name: str = None, state: TaskState = None) -> List[Task]:
+        tasks = self.by_id
+        if name is not None:
+            tasks = self.by_name.get(name, {})
+        if state is not None:
+            by_state = self.by_state[state]
+            if len(by_state) < len(tasks):
+                return [t for t in by_state.values() if name is None or t.name == name]
+            return [t for t in tasks.values() if t.id in by_state]
+        return list(tasks.values())
+
+    def count(self) -> Dict[str, int]:
+        return {state.value: len(tasks) for state, tasks in self.by_state.items()}
 
 
 class TaskManager:
+    GET_ALL_LIMIT = 1000
+
     def __init__(self):
         self.counter = 0
-        self.scheduler_job = None
-        self.task_list: List[Task] = []
+        self.scheduler = CronScheduler(self.cron_fire)
+        self.cron_admission = CronAdmission(self.start)
+        self.task_list_model = TaskListModel(self)
+        self.tasks = TaskIndex(on_change=self.task_list_model.mark_task)
         self.cron_list: List[CronEntity] = []
         self.ifttt_list: List[IftttEntity] = []
+        self.ifttt_index = IftttIndex()
+        self.ifttt_ticker_seq = 0
         self.start_time = datetime.now()
+        self.stats_providers: Dict[str, Callable[[], Any]] = {}
 
-        event_bus.add_listener(Event.TICKER_UPDATE, self.ifttt_scan)
-        event_bus.add_listener(Event.TASK_FINISHED, self.catch_task_finished)
+        event_bus.add_listener(Event.TICKER_UPDATE, self.ifttt_scan,
+                               maxsize=1, policy=OverflowPolicy.COALESCE)
 
     def add(self, task: Task):
         self.counter += 1
         task.id = self.counter
-        self.task_list.append(task)
+        task.invalidate_info()
+        self.tasks.add(task)
+        self.task_list_model.mark(task.id)
 
     def start(self, op: Operation):
         if 'ifttt' in op.kwargs:
             conditions = op.kwargs['ifttt']
             del op.kwargs['ifttt']
-            self.ifttt_add(conditions, op)
+            ret = self.ifttt_add(conditions, op)
+            if ret != RESP_OK:
+                op.resp_code = RESP_ERR
+                op.output = ret
             return
         if 'cron' in op.kwargs:
             cron_schedule = op.kwargs['cron']
             del op.kwargs['cron']
-            self.cron_add(cron_schedule, op)
+            ret = self.cron_add(cron_schedule, op)
+            if ret != RESP_OK:
+                op.resp_code = RESP_ERR
+                op.output = ret
             return
         cmd = op.cmd
         mod = import_module('cbot.server.tasks.job_' + cmd)
         job = getattr(mod, 'job_' + cmd, None)
         if callable(job):
             self.add(Task(op, job, name=cmd))
-            self.emit_lists()
         else:
             logger.error('Non-callable job: %s', cmd)
 
-    def get_all_lists(self):
-        return {
-            'cron_list': self.cron_list,
-            'ifttt_list': self.ifttt_list,
-            'tasks': self.tasks_get_info_list(),
-        }
-
-    def emit_lists(self):
-        event_bus.emit(Event.TASK_MANAGER, self.get_all_lists())
-
-    def tasks_get_list(self):
-        return self.task_list
+    def tasks_get_list(self, name: str = None, state: TaskState = None) -> List[Task]:
+        return self.tasks.select(name, state)
 
     def tasks_get_info_list(self):
-        return list(map(lambda x: x.to_info_dict(), self.task_list))
+        return list(map(lambda x: x.to_info_dict(), self.tasks))
 
     def cron_get_list(self):
         return self.cron_list
 
-    def cron_add(self, schedule: str, op: Operation):
-        self.cron_list.append(CronEntity(schedule, op))
-        self.emit_lists()
+    def cron_add(self, schedule: str, op: Operation) -> str:
+        try:
+            self.cron_list.append(CronEntity(schedule, op))
+        except ValueError as exc:
+            return f'cron: {exc}'
+        self.scheduler.reschedule(self.cron_list)
+        self.task_list_model.mark_lists()
+        return RESP_OK
 
     def cron_modify(self, position: int, schedule: str, is_paused: bool = False):
         try:
             op = self.cron_list[position].op
             self.cron_list[position] = CronEntity(schedule, op, is_paused)
+            self.scheduler.reschedule(self.cron_list)
+            self.task_list_model.mark_lists()
             return RESP_OK
-        except IndexError as exc:
+        except (IndexError, ValueError) as exc:
             return str(exc)
 
     def cron_pause(self, position: int):
         try:
             self.cron_list[position].is_paused = not self.cron_list[position].is_paused
-            self.emit_lists()
+            self.scheduler.reschedule(self.cron_list)
+            self.task_list_model.mark_lists()
             return RESP_OK
         except IndexError as exc:
             return str(exc)
@@ -148,11 +196,13 @@ class TaskManager:
     def cron_delete(self, position: int, delete_all: bool = False) -> str:
         if delete_all:
             self.cron_list = []
-            self.emit_lists()
+            self.scheduler.reschedule(self.cron_list)
+            self.task_list_model.mark_lists()
             return RESP_OK
         try:
             del self.cron_list[position]
-            self.emit_lists()
+            self.scheduler.reschedule(self.cron_list)
+            self.task_list_model.mark_lists()
             return RESP_OK
         except IndexError as exc:
             return str(exc)
@@ -160,16 +210,28 @@ class TaskManager:
     def ifttt_get_list(self):
         return self.ifttt_list
 
-    def ifttt_add(self, conditions: str, op: Operation):
+    def ifttt_add(self, conditions: str, op: Operation) -> str:
+        entries = []
         for cond in conditions.split(';'):
             cond = cond.strip()
-            self.ifttt_list.append(IftttEntity(cond, op))
-        self.emit_lists()
+            try:
+                entries.append(IftttEntity(cond, op))
+            except SyntaxError as exc:
+                return f'ifttt: invalid condition ({cond}): {exc}'
+        for entry in entries:
+            self.ifttt_list.append(entry)
+            self.ifttt_index.add(entry)
+        self.task_list_model.mark_lists()
+        return RESP_OK
+
+    def ifttt_remove(self, entry: IftttEntity):
+        self.ifttt_list.remove(entry)
+        self.ifttt_index.remove(entry)
 
     def ifttt_pause(self, position: int):
         try:
             self.ifttt_list[position].is_paused = not self.ifttt_list[position].is_paused
-            self.emit_lists()
+            self.task_list_model.mark_lists()
             return RESP_OK
         except IndexError as exc:
             return str(exc)
@@ -177,54 +239,55 @@ class TaskManager:
     def ifttt_delete(self, position: int, delete_all: bool = False) -> str:
         if delete_all:
             self.ifttt_list = []
-            self.emit_lists()
+            self.ifttt_index.clear()
+            self.task_list_model.mark_lists()
             return RESP_OK
         try:
-            del self.ifttt_list[position]
-            self.emit_lists()
+            self.ifttt_remove(self.ifttt_list[position])
+            self.task_list_model.mark_lists()
             return RESP_OK
         except IndexError as exc:
             return str(exc)
 
     async def ifttt_scan(self, tickers: Dict):
-        for entry in self.ifttt_list[:]:
+        self.ifttt_ticker_seq, changed = memstore.get_changed_tickers(self.ifttt_ticker_seq)
+        for entry in self.ifttt_index.lookup(changed, tickers):
             if entry.is_paused:
                 continue
             condition = entry.condition
             op = entry.op
             try:
-                if eval(condition, {}, tickers):  # pylint: disable=eval-used
+                if entry.evaluate(tickers):
                     logger.info('Executing ifttt job (%s): %s', condition, op)
                     self.start(op)
-                    self.ifttt_list.remove(entry)  # run only once
+                    self.ifttt_remove(entry)  # run only once
+                    self.task_list_model.mark_lists()
                 else:
                     logger.debug('IFTTT no match: %s', condition)
             except Exception:
-                self.ifttt_list.remove(entry)  # run only once
+                self.ifttt_remove(entry)  # run only once
+                self.task_list_model.mark_lists()
                 logger.exception('IFTTT eval (%s)', condition)
 
     def kill(self, task_id: int) -> str:
         """Kills a single task"""
-        t: Task = next(filter(lambda x: x.id == task_id, self.task_list), None)
+        t: Task = self.tasks.get(task_id)
         if t:
             t.kill()
-            self.emit_lists()
             return RESP_OK
         return 'kill: unknown task id #%d' % task_id
 
     def kill_all(self):
         """Kills all tasks"""
-        for t in self.task_list:
-            t.kill()
-        self.emit_lists()
+        for state in (TaskState.RUNNING, TaskState.PAUSED):
+            for t in self.tasks.select(state=state):
+                t.kill()
 
     def pause_task(self, task_id: int) -> str:
         """Pauses and unpauses a single task"""
-        t: Task = next(filter(lambda x: x.id == task_id, self.task_list), None)
+        t: Task = self.tasks.get(task_id)
         if t:
-            ret = t.pause()
-            self.emit_lists()
-            return ret
+            return t.pause()
         return 'pause: unknown task id #%d' % task_id
 
     def reload(self, cmd: str) -> str:  # pylint: disable=no-self-use
@@ -234,23 +297,21 @@ class TaskManager:
 
     def clean(self):
         """Removes finished tasks from task list"""
-        for t in list(filter(lambda x: x.is_finished, self.task_list)):
-            self.task_list.remove(t)
-        self.emit_lists()
+        for t in self.tasks.select(state=TaskState.FINISHED):
+            self.tasks.remove(t)
+            self.task_list_model.mark(t.id)
 
-    def get_output(self, task_id: int = None, num: int = None) -> list:
+    def get_output(self, task_id: int = None, num: int = None,
+                   since: int = None) -> list:
         """Gets output from a single or many tasks"""
         if task_id == -1:
-            res = []
-            for t in self.task_list:
-                res.extend(t.get_output(num))
-            return res
+            return self.get_merged_output(num=num, since=since)
 
         if task_id is None:
-            task_id = self.task_list[-1].id if len(self.task_list) > 0 else 0
-        t: Task = next(filter(lambda x: x.id == task_id, self.task_list), None)
+            task_id = self.tasks.last().id if len(self.tasks) > 0 else 0
+        t: Task = self.tasks.get(task_id)
         if t:
-            return t.get_output(num)
+            return t.get_output(num, since)
 
         return [{
             'ts': 0,
@@ -258,54 +319,71 @@ class TaskManager:
             'msg': 'get_output: unknown task id #%d' % task_id
         }]
 
+    # each argument is an independent, optional filter of the get command
+    def get_merged_output(self, num: int = None, since: int = None,  # pylint: disable=too-many-arguments
+                          since_ts: float = None, name: str = None,
+                          level: str = None, limit: int = None) -> list:
+        """Gets output of all tasks ordered by time.
+
+        Every task's buffer is walked from its newest line and the walks
+        are merged on `ts`, stopping after `limit` lines, so the cost does
+        not depend on how much history the tasks keep. `num` and `since`
+        (a seq number) apply to each task, `since_ts` to all of them.
+        """
+        def newest_first(t: Task) -> Iterator[Dict]:
+            lines = reversed(t.output)
+            if since is not None:
+                lines = takewhile(lambda x: x['seq'] > since, lines)
+            if since_ts is not None:
+                lines = takewhile(lambda x: x['ts'] > since_ts, lines)
+            if level is not None:
+                lines = (x for x in lines if x.get('level', 'info') == level)
+            return islice(lines, num or None)
+
+        merged = heapq.merge(*map(newest_first, self.tasks.select(name)),
+                             key=lambda x: x['ts'], reverse=True)
+        res = list(islice(merged, limit or self.GET_ALL_LIMIT))
+        res.reverse()
+        return res
+
     def get_info(self, task_id: int = None) -> Any:
         """Gets info from a single task"""
         if task_id is None:
-            task_id = self.task_list[-1].id if len(self.task_list) > 0 else 0
-        t: Task = next(filter(lambda x: x.id == task_id, self.task_list), None)
+            task_id = self.tasks.last().id if len(self.tasks) > 0 else 0
+        t: Task = self.tasks.get(task_id)
         if t:
             return t.get_info()
         return 'get_info: unknown task id #%d' % task_id
 
     def modify_task_data(self, task_id: int, op: Operation) -> str:
-        t: Task = next(filter(lambda x: x.id == task_id, self.task_list), None)
+        t: Task = self.tasks.get(task_id)
         if t:
             ret = t.modify_data(op.kwargs)
-            self.emit_lists()
+            self.task_list_model.mark(task_id)
             return ret
         return 'modify_task_data: unknown task id #%d' % task_id
 
-    async def catch_task_finished(self, _task_id: int):
-        self.emit_lists()
-
     async def scheduler_start(self):
-        self.scheduler_job = Periodic(self.scheduler_runner, interval=60)
-        await self.scheduler_job.start()
-        try:
-            while self.scheduler_job.is_running:
-                await asyncio.sleep(1)
-        finally:
-            await self.scheduler_job.stop()
+        self.scheduler.reschedule(self.cron_list)
+        await self.scheduler.run()
 
     def scheduler_stop(self):
-        self.scheduler_job.stop()
+        self.scheduler.stop()
 
-    async def scheduler_runner(self):
-        for cron_entry in self.cron_list:
-            if cron_entry.is_paused:
-                continue
-            if pycron.is_now(cron_entry.schedule):
-                logger.info('Executing cron job (%s): %s',
-                            cron_entry.schedule, cron_entry.op.cmd)
-                self.start(cron_entry.op)
-        return PeriodicRunStatus.CONTINUE
+    def cron_fire(self, cron_entry: CronEntity):
+        op = cron_entry.op
+        logger.info('Executing cron job (%s): %s', cron_entry.schedule, op.cmd)
+        exchange_id = op.kwargs.get('exchange')
+        if not exchange_id and op.cmd.startswith('crypto_'):
+            exchange_id = config.conf.sections['server'].get('default_exchange')
+        self.cron_admission.submit(exchange_id, op)
 
     def to_savegame(self):
         data = {
             'counter': self.counter,
             'cron_list': self.cron_list,
             'ifttt_list': self.ifttt_list,
-            'tasks': list(map(lambda x: x.to_savegame(), self.task_list)),
+            'tasks': list(map(lambda x: x.to_savegame(), self.tasks)),
         }
         logger.debug('task_manager::to_savegame: %s', data)
         return data
@@ -314,7 +392,12 @@ class TaskManager:
         logger.debug('task_manager::from_savegame: %s', pick_data)
         self.counter = pick_data['counter']
         self.cron_list = pick_data.get('cron_list', [])
+        self.scheduler.reschedule(self.cron_list)
         self.ifttt_list = pick_data.get('ifttt_list', [])
+        self.ifttt_index.clear()
+        for entry in self.ifttt_list:
+            self.ifttt_index.add(entry)
+        self.task_list_model.mark_lists()
 
         task_info: TaskInfo
         for task_info in pick_data['tasks']:
@@ -324,15 +407,36 @@ class TaskManager:
             job = getattr(mod, 'job_' + name, None)
             if callable(job):
                 task = Task(op, job, name=name, task_info=task_info)
-                self.task_list.append(task)
+                self.tasks.add(task)
+                self.task_list_model.mark(task.id)
 
     async def process_request(self, request: str) -> Operation:
-        op = Operation()
+        op, data = self.parse_request(request)
+        if data is not None:
+            await self.process_parsed(op, data)
+        return op
+
+    def parse_request(self, request: Union[str, bytes],
+                      decode: Callable[[Any], Any] = None) -> Tuple[Operation, Optional[Dict]]:
+        """Parses a request, JSON unless another decode is given,
+        data is None when there is nothing to run"""
         if not request:
-            return op
+            return Operation(), None
+        try:
+            data = (decode or serializer.loads)(request)
+        except Exception as exc:
+            logger.exception('Exception')
+            op = Operation()
+            op.resp_code = 'ERR'
+            op.output = 'ERR: %s' % exc
+            return op, None
+        return self.parse_data(data)
+
+    def parse_data(self, data: Dict) -> Tuple[Operation, Optional[Dict]]:
+        op = Operation()
         try:
-            data = json.loads(request)
             logger.debug('Incoming data: %s', data)
+            op.request_id = data.get('id')
             if 'raw_input' in data:
                 cmd_args, cmd_kwargs = task_manager.parse_args(data['raw_input'])
                 op.cmd = cmd_args[0].lower()
@@ -346,20 +450,53 @@ class TaskManager:
             logger.exception('Exception')
             op.resp_code = 'ERR'
             op.output = 'ERR: %s' % exc
-            return op
+            return op, None
+        return op, data
 
-        await task_manager.process_cmd(op)
+    async def process_parsed(self, op: Operation, data: Dict):
+        if op.cmd == 'batch':
+            await self.process_batch(op)
+        else:
+            await task_manager.process_cmd(op)
 
         if 'raw_input' not in data:
             op.output = None
-        return op
+
+    async def process_batch(self, op: Operation):
+        """Runs the requests listed in args one after another,
+        data holds their responses in the same order"""
+        results = []
+        for request in op.args:
+            if isinstance(request, dict):
+                sub_op, data = self.parse_data(request)
+            else:
+                sub_op, data = Operation(), None
+                sub_op.resp_code = 'ERR'
+                sub_op.output = 'ERR: Invalid request'
+            if sub_op.cmd == 'batch':
+                sub_op.resp_code = 'ERR'
+                sub_op.output = 'ERR: Nested batch'
+            elif data is not None:
+                try:
+                    await self.process_parsed(sub_op, data)
+                except Exception as exc:  # pylint: disable=broad-except
+                    logger.exception('Exception')
+                    sub_op.set_error(exc)
+            results.append(sub_op.to_response_json())
+        op.data_json_items = results
+        op.output = '%d operations' % len(results)
 
     async def process_cmd(self, op: Operation):
         cmd = op.cmd.upper()
         if cmd == 'PS':
-            op.data = self.tasks_get_info_list()
-            op.output = list(map(str, self.tasks_get_list()))
-            self.emit_lists()
+            try:
+                state = TaskState(op.kwargs['state']) if 'state' in op.kwargs else None
+            except ValueError as exc:
+                op.output = str(exc)
+                return
+            tasks = self.tasks_get_list(op.kwargs.get('name'), state)
+            op.data_json_items = [x.to_info_json() for x in tasks]
+            op.output = list(map(str, tasks))
         elif cmd == 'INFO':
             try:
                 task_id = int(op.args[0]) if len(op.args) > 0 else None
@@ -400,7 +537,16 @@ class TaskManager:
             try:
                 task_id = int(op.args[0]) if len(op.args) > 0 else None
                 num = int(op.args[1]) if len(op.args) > 1 else None
-                op.data = self.get_output(task_id, num=num)
+                since = int(op.kwargs['since']) if 'since' in op.kwargs else None
+                if task_id == -1:
+                    since_ts = float(op.kwargs['since_ts']) if 'since_ts' in op.kwargs else None
+                    limit = int(op.kwargs['limit']) if 'limit' in op.kwargs else None
+                    op.data = self.get_merged_output(
+                        num=num, since=since, since_ts=since_ts,
+                        name=op.kwargs.get('name'), level=op.kwargs.get('level'),
+                        limit=limit)
+                else:
+                    op.data = self.get_output(task_id, num=num, since=since)
             except (IndexError, ValueError) as exc:
                 op.data = [{'ts': 0, 'taskId': 0, 'msg': str(exc)}]
         elif cmd == 'CRON':
@@ -425,7 +571,7 @@ class TaskManager:
                 op.data = res
                 op.output = '\n'.join(res)
         elif cmd == 'SAVEGAME':
-            event_bus.emit(Event.SAVEGAME)
+            await event_bus.emit_wait(Event.SAVEGAME)
         elif cmd == 'MEMSTORE':
             if 'keys' in op.args:
                 ret = memstore.get_keys()
@@ -471,14 +617,19 @@ class TaskManager:
         savegame_last_update = memstore.get('savegame_last_update')
         if savegame_last_update:
             savegame_last_update = savegame_last_update.isoformat()
-        return {
+        stats = {
             'version': VERSION,
             'start_time': self.start_time.isoformat(),
             'start_time_ts': get_timestamp(self.start_time),
             'savegame_last_update': savegame_last_update,
             'uptime': str(datetime.now() - self.start_time),
             'uptime_ts': int((datetime.now() - self.start_time).total_seconds()),
+            'tasks': self.tasks.count(),
+            'event_bus': event_bus.get_stats(),
         }
+        for name, provider in self.stats_providers.items():
+            stats[name] = provider()
+        return stats
 
 
 task_manager = TaskManager()
@@ -25,6 +25,7 @@ from binance import AsyncClient, BinanceSocketManager
 from binance.enums import KLINE_INTERVAL_1MINUTE
 
 from cbot.server.event_bus import Event, event_bus
+from cbot.server.live_board import LiveBoard
 from cbot.server.logger import logger
 from cbot.server.memstore import memstore
 from cbot.server.task import Task
@@ -136,7 +137,8 @@ async def runner(task: Task, client):
 
     data = {}
     tmp = {}
-    output = {}
+    board = LiveBoard()
+    memstore.add('bin_live', board.rows)
 
     if 'klines' in task_data.streams:
         printer('Getting klines...')
@@ -159,9 +161,7 @@ async def runner(task: Task, client):
                 data[symbol].append(tmp[last_kline])
                 del tmp[last_kline]
 
-            sorted_output = calc_output(data, output, symbol)
-            memstore.add('bin_live', sorted_output)
-            event_bus.emit(Event.BIN_LIVE_UPDATE, sorted_output)
+            emit_update(board, calc_row(data, symbol))
 
             await asyncio.sleep(0.2)
 
@@ -215,9 +215,7 @@ async def runner(task: Task, client):
                     data[symbol].append(tmp[last_kline])
                     del tmp[last_kline]
 
-                    sorted_output = calc_output(data, output, symbol)
-                    memstore.add('bin_live', sorted_output)
-                    event_bus.emit(Event.BIN_LIVE_UPDATE, sorted_output)
+                    emit_update(board, calc_row(data, symbol))
 
             elif isinstance(r, list):  # Streaming tickers
                 tickers = []
@@ -231,12 +229,19 @@ async def runner(task: Task, client):
                         'P': tick['P'],  # price change percent
                     })
                 tickers.sort(key=lambda x: float(x['P']), reverse=True)
+                memstore.add('stream_tickers', tickers[:100])
                 event_bus.emit(Event.STREAM_TICKERS, tickers[:100])
 
             await asyncio.sleep(0.1)
 
 
-def calc_output(data, output, symbol):
+def emit_update(board: LiveBoard, row):
+    delta = board.update(row)
+    memstore.add('bin_live_version', board.version)
+    event_bus.emit(Event.BIN_LIVE_UPDATE, delta)
+
+
+def calc_row(data, symbol):
     last_01m = data[symbol][-1]
     last_03m = data[symbol][-3:]
     last_05m = data[symbol][-5:]
@@ -251,7 +256,7 @@ def calc_output(data, output, symbol):
     last_10m_pt = ((Decimal(last_10m_c) - Decimal(last_10m_o)) / Decimal(last_10m_o)) * Decimal('100')
     last_15m_pt = ((Decimal(last_15m_c) - Decimal(last_15m_o)) / Decimal(last_15m_o)) * Decimal('100')
 
-    output[symbol] = {
+    v = {
         '1m': round(last_01m[2], 2),
         '3m': round(last_03m_pt, 2),
         '5m': round(last_05m_pt, 2),
@@ -259,22 +264,17 @@ def calc_output(data, output, symbol):
         '15m': round(last_15m_pt, 2),
     }
 
-    sorted_output = []
-    for s, v in output.items():
-        pts = 0
-        pts += 1 if v['1m'] > 0 else 0
-        pts += 2 if v['3m'] > 0 else 0
-        pts += 3 if v['5m'] > 0 else 0
-        pts += 4 if v['10m'] > 0 else 0
-        sorted_output.append({
-            's': s,
-            '1m': v['1m'],
-            '3m': v['3m'],
-            '5m': v['5m'],
-            '10m': v['10m'],
-            '15m': v['15m'],
-            'pts': pts,
-        })
-        sorted_output.sort(key=lambda x: x['5m'], reverse=True)
-
-    return sorted_output
+    pts = 0
+    pts += 1 if v['1m'] > 0 else 0
+    pts += 2 if v['3m'] > 0 else 0
+    pts += 3 if v['5m'] > 0 else 0
+    pts += 4 if v['10m'] > 0 else 0
+    return {
+        's': symbol,
+        '1m': v['1m'],
+        '3m': v['3m'],
+        '5m': v['5m'],
+        '10m': v['10m'],
+        '15m': v['15m'],
+        'pts': pts,
+    }
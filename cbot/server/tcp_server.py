@@ -17,65 +17,219 @@
 # with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import json
+import asyncio
+import os
 import socket
-from asyncio import AbstractEventLoop
+from asyncio import StreamReader, StreamWriter
+from contextlib import suppress
+from typing import Any, Dict, Optional, Union
 
+from cbot.server import serializer
+from cbot.server.codec import JSON, get_codec
+from cbot.server.connection import Connection, RequestDispatcher, broadcast, process_subscription
+from cbot.server.event_bus import event_bus, Event, OverflowPolicy
+from cbot.server.framing import FrameDecoder, FramingError, encode_frame
 from cbot.server.logger import logger
+from cbot.server.operation import Operation
 from cbot.server.task_manager import task_manager
 
 
 class Server:
-    CHUNK_LIMIT = 1024
+    CHUNK_LIMIT = 65536
+    BACKLOG = 128
+    IDLE_TIMEOUT = 300
+    MAX_CONNECTIONS = 256
+    MAX_IN_FLIGHT = 8
+    UNIX_SOCKET_MODE = 0o600
 
-    def __init__(self, loop: AbstractEventLoop, addr: str, port: int):
-        self.loop = loop
+    # the limits are separate settings of the [server] section
+    def __init__(self, addr: str, port: int,  # pylint: disable=too-many-arguments
+                 backlog: int = None, idle_timeout: float = None,
+                 max_connections: int = None, unix_socket: str = None):
         self.addr = addr
         self.port = port
-        self.server = None
-
-    def listen(self):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server.bind((self.addr, self.port))
-        self.server.listen(1)
-        self.server.setblocking(False)
-        logger.info('Listening at %s:%d', self.addr, self.port)
+        self.backlog = backlog or self.BACKLOG
+        self.idle_timeout = self.IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.max_connections = max_connections or self.MAX_CONNECTIONS
+        self.unix_socket = unix_socket
+        self.servers = []
+        self.closing = []
+        self.clients = set()
+        self.subscribers: Dict[StreamWriter, Connection] = {}
+        self.refused = 0
 
     async def run(self):
-        while True:
-            client, addr = await self.loop.sock_accept(self.server)
-            self.loop.create_task(self.handle_client(client, addr))
+        self.servers.append(await asyncio.start_server(
+            self.handle_client, self.addr, self.port, backlog=self.backlog))
+        logger.info('Listening at %s:%d', self.addr, self.port)
+        if self.unix_socket:
+            if os.path.exists(self.unix_socket):
+                os.unlink(self.unix_socket)
+            self.servers.append(await asyncio.start_unix_server(
+                self.handle_client, self.unix_socket, backlog=self.backlog))
+            os.chmod(self.unix_socket, self.UNIX_SOCKET_MODE)
+            logger.info('Listening at %s', self.unix_socket)
+        event_bus.add_listener(Event.ALL, self.event_to_all,
+                               policy=OverflowPolicy.COALESCE)
+        task_manager.stats_providers['tcp_connections'] = self.get_stats
 
     def close(self):
-        self.server.close()
-
-    async def handle_client(self, client: socket, addr):
-        logger.debug('Received connection from %s:%d', addr[0], addr[1])
-        while True:
-            request = await self.read_request(client)
-            is_done = False
-            if request:
-                op = await task_manager.process_request(request)
-                payload = json.dumps(op.to_response(), default=str)
-                await self.send_response(client, payload)
-                if op.cmd == 'QUIT':
-                    is_done = True
+        for server in self.servers:
+            server.close()
+        if self.servers:
+            event_bus.remove_listener(Event.ALL, self.event_to_all)
+            self.closing, self.servers = self.servers, []
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    async def wait_closed(self):
+        for server in self.closing:
+            await server.wait_closed()
+        self.closing = []
+
+    def get_stats(self):
+        return {
+            'connections': len(self.clients),
+            'max_connections': self.max_connections,
+            'refused': self.refused,
+            'subscribers': [con.stats() for con in self.subscribers.values()],
+        }
+
+    async def event_to_all(self, event_name: Event, data: Any = None):
+        broadcast(self.subscribers.values(), event_name, data, serializer.dumps)
+
+    async def handle_client(self, reader: StreamReader, writer: StreamWriter):
+        peer = writer.get_extra_info('peername') or 'unix socket'
+        if len(self.clients) >= self.max_connections:
+            self.refused += 1
+            logger.warning('Refusing connection from %s, %d clients connected',
+                           peer, len(self.clients))
+            writer.close()
+            return
+        sock = writer.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        logger.debug('Received connection from %s', peer)
+        self.clients.add(writer)
+        try:
+            await self.serve(reader, writer, peer)
+        except (ConnectionError, asyncio.TimeoutError) as exc:
+            logger.debug('Connection with %s lost: %s', peer, exc or 'idle timeout')
+        finally:
+            self.clients.discard(writer)
+            con = self.subscribers.pop(writer, None)
+            if con:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(con.drain(), 1)
+                con.close()
+            logger.debug('Closing connection with %s', peer)
+            writer.close()
+
+    async def serve(self, reader: StreamReader, writer: StreamWriter, peer):
+        """Requests are run by a RequestDispatcher, so tagged ones run
+        concurrently; encoding requests never do.
+
+        After a subscribe the subscribed events are sent as
+        {"stream": ..., "data": ...} messages too, and the idle timeout
+        no longer applies.
+
+        An encoding request switches both directions to another encoding
+        once its response, still in the old one, is sent."""
+        decoder = FrameDecoder()
+        codec = JSON
+        send_lock = asyncio.Lock()
+
+        async def send(payload):
+            async with send_lock:
+                await self.send_message(writer, payload, decoder.line_mode)
+
+        async def run_request(op, data):
+            nonlocal codec
+            new_codec = None
+            if data is None:
+                pass
+            elif op.cmd == 'encoding':
+                new_codec = self.process_encoding(op, decoder.line_mode)
+            elif op.cmd == 'subscribe':
+                con = self.subscribers.get(writer)
+                if con is None:
+                    con = Connection(str(peer), send, lambda _con: writer.close())
+                    con.codec = codec
+                    con.start()
+                    self.subscribers[writer] = con
+                process_subscription(con, op)
+            elif op.cmd == 'unsubscribe':
+                if writer in self.subscribers:
+                    process_subscription(self.subscribers[writer], op)
+                else:
+                    op.output = 'Not subscribed'
             else:
-                is_done = True
-            if is_done:
-                logger.debug('Closing connection with %s:%d', addr[0], addr[1])
-                client.close()
-                break
-
-    async def read_request(self, client: socket) -> str:
-        request = ''
-        while True:
-            chunk = (await self.loop.sock_recv(client, self.CHUNK_LIMIT)).decode('utf8')
-            request += chunk
-            if len(chunk) < self.CHUNK_LIMIT:
-                break
-        return request
-
-    def send_response(self, client: socket, response: str):
-        return self.loop.sock_sendall(client, response.encode('utf8') + b'\r\n')
+                await task_manager.process_parsed(op, data)
+            async with send_lock:
+                await self.send_response(writer, op, decoder.line_mode, codec)
+            if new_codec:
+                codec = new_codec
+                if writer in self.subscribers:
+                    self.subscribers[writer].codec = codec
+
+        dispatcher = RequestDispatcher(run_request, self.MAX_IN_FLIGHT)
+        try:
+            while True:
+                timeout = None if writer in self.subscribers else self.idle_timeout
+                data = await asyncio.wait_for(reader.read(self.CHUNK_LIMIT),
+                                              timeout or None)
+                if not data:
+                    return
+                try:
+                    requests = decoder.feed(data)
+                except FramingError as exc:
+                    logger.warning('Bad request from %s: %s', peer, exc)
+                    return
+                for request in requests:
+                    op, data = task_manager.parse_request(request, codec.decode)
+                    await dispatcher.dispatch(op, data,
+                                              concurrent=op.cmd != 'encoding')
+                    if op.cmd == 'QUIT':
+                        return
+        finally:
+            await dispatcher.wait()
+
+    @staticmethod
+    def process_encoding(op: Operation, line_mode: Optional[bool]):
+        """Returns the codec an encoding request asks for, None when it
+        cannot be used"""
+        try:
+            codec = get_codec(op.args[0] if op.args else 'json')
+        except ValueError as exc:
+            op.resp_code = 'ERR'
+            op.output = str(exc)
+            return None
+        if codec.binary and line_mode:
+            op.resp_code = 'ERR'
+            op.output = 'Binary encodings need framing'
+            return None
+        op.output = 'Encoding: %s' % codec.name
+        return codec
+
+    @staticmethod
+    async def send_response(writer: StreamWriter, op: Operation,
+                            line_mode: Optional[bool], codec=JSON):
+        if codec.binary:
+            parts = map(codec.encode, op.iter_responses())
+        elif line_mode:
+            parts = [op.to_response_json()]
+        else:
+            parts = op.iter_response_json()
+        for part in parts:
+            await Server.send_message(writer, part, line_mode)
+
+    @staticmethod
+    async def send_message(writer: StreamWriter, message: Union[str, bytes],
+                           line_mode: Optional[bool]):
+        if isinstance(message, str):
+            message = message.encode('utf8')
+        if line_mode:
+            writer.write(message + b'\r\n')
+        else:
+            writer.write(encode_frame(message))
+        await writer.drain()
@@ -0,0 +1,60 @@
+"""
+# test_codec.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+from decimal import Decimal
+from unittest import TestCase, skipUnless
+
+from cbot.server import serializer
+from cbot.server.codec import JSON, MSGPACK, get_codec
+from cbot.server.connection import Frame
+from cbot.server.event_bus import Event
+
+
+class Test(TestCase):
+
+    def test_get_codec(self):
+        self.assertIs(get_codec(), JSON)
+        self.assertRaises(ValueError, get_codec, 'xml')
+
+    def test_json_batch(self):
+        frame = Frame(Event.LOGGER, [{'msg': 'a'}], serializer.dumps)
+        payloads = [JSON.frame(frame), JSON.frame('{"stream":"RESULT","data":1}')]
+        self.assertEqual(json.loads(JSON.batch(payloads)), {
+            'stream': 'BATCH', 'data': [
+                {'stream': 'LOGGER', 'data': [{'msg': 'a'}]},
+                {'stream': 'RESULT', 'data': 1},
+            ]})
+
+    @skipUnless(serializer.msgpack, 'msgpack is not installed')
+    def test_msgpack_batch(self):
+        self.assertIs(get_codec('msgpack'), MSGPACK)
+        for size in (1, 15, 16, 100):
+            frame = Frame(Event.CRYPTO_TSL_UPDATE,
+                          {'taskId': 3, 'price': Decimal('7.5021')}, serializer.dumps)
+            payloads = [MSGPACK.frame(frame)] * (size - 1)
+            payloads.append(MSGPACK.frame('{"stream":"RESULT","data":[1,2]}'))
+            batch = MSGPACK.decode(MSGPACK.batch(payloads))
+            self.assertEqual(batch['stream'], 'BATCH')
+            self.assertEqual(len(batch['data']), size)
+            self.assertEqual(batch['data'][-1], {'stream': 'RESULT', 'data': [1, 2]})
+            if size > 1:
+                self.assertEqual(batch['data'][0], {
+                    'stream': 'CRYPTO_TSL_UPDATE',
+                    'data': {'taskId': 3, 'price': '7.5021'}})
@@ -0,0 +1,120 @@
+"""
+# test_connection.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+from unittest import TestCase
+
+from cbot.server.connection import Connection, Frame, process_subscription
+from cbot.server.event_bus import Event
+from cbot.server.operation import Operation
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.sent = []
+        self.evicted = []
+        self.gate = None
+
+    async def send(self, payload):
+        if self.gate:
+            await self.gate.wait()
+        self.sent.append(payload)
+
+    def make(self, maxsize=3):
+        con = Connection('test', self.send, self.evicted.append)
+        con.MAXSIZE = maxsize
+        con.start()
+        return con
+
+    def test_order(self):
+        async def run():
+            con = self.make()
+            con.put('RESULT', '0')
+            await con.drain()
+            for i in range(1, 4):
+                con.put('RESULT', str(i))
+            await con.drain()
+            self.assertEqual(con.stats()['depth'], 0)
+            self.assertEqual(con.stats()['sent'], 4)
+            con.close()
+        asyncio.run(run())
+        self.assertEqual(self.sent, ['0', '{"stream":"BATCH","data":[1,2,3]}'])
+
+    def test_slow_consumer(self):
+        async def run():
+            self.gate = asyncio.Event()
+            con = self.make()
+            con.put(Event.TICKER_UPDATE, 'a')
+            con.put(Event.TICKER_UPDATE, 'b')
+            con.put(Event.LOGGER, 'c')
+            con.put(Event.LOGGER, 'd')
+            con.put(Event.LOGGER, 'e')
+            self.assertEqual(con.stats()['depth'], 3)
+            self.assertEqual(con.stats()['coalesced'], 1)
+            self.assertEqual(con.stats()['dropped'], 1)
+            self.assertEqual(self.evicted, [])
+            con.put('RESULT', 'f')
+            self.assertEqual(self.evicted, [con])
+            con.put('RESULT', 'g')
+            self.assertEqual(con.stats()['depth'], 0)
+        asyncio.run(run())
+        self.assertEqual(self.sent, [])
+
+    def test_lag(self):
+        async def run():
+            self.gate = asyncio.Event()
+            con = self.make()
+            con.MAX_LAG = 0.01
+            con.put('RESULT', '1')
+            await asyncio.sleep(0.02)
+            con.put('RESULT', '2')
+            self.assertEqual(self.evicted, [con])
+        asyncio.run(run())
+
+    def test_rate(self):
+        async def run():
+            con = self.make(maxsize=10)
+            con.set_rate(Event.CRYPTO_TSL_UPDATE, 20)
+            for i in range(5):
+                con.put(Event.CRYPTO_TSL_UPDATE, Frame('S', i, json.dumps), 1)
+                con.put(Event.CRYPTO_TSL_UPDATE, Frame('S', i, json.dumps), 2)
+                await asyncio.sleep(0)
+            self.assertEqual(con.stats()['throttled'], 6)
+            await asyncio.sleep(0.07)
+            con.close()
+        asyncio.run(run())
+        frames = [json.loads(payload) for payload in self.sent]
+        self.assertEqual(frames, [
+            {'stream': 'BATCH', 'data': [{'stream': 'S', 'data': 0}] * 2},
+            {'stream': 'BATCH', 'data': [{'stream': 'S', 'data': 4}] * 2},
+        ])
+
+    def test_subscription_rate(self):
+        con = Connection('test', self.send)
+        op = Operation('subscribe', ['CRYPTO_TSL_UPDATE'], {'hz': '1', 'taskId': '3'})
+        process_subscription(con, op)
+        self.assertEqual(op.resp_code, 'OK')
+        self.assertEqual(con.rates[Event.CRYPTO_TSL_UPDATE], 1)
+        op = Operation('subscribe', ['BIN_LIVE_UPDATE'], {'hz': '1'})
+        process_subscription(con, op)
+        self.assertEqual(op.resp_code, 'ERR')
+        self.assertNotIn(Event.BIN_LIVE_UPDATE, con.rates)
+        self.assertFalse(con.subscription.wants(Event.BIN_LIVE_UPDATE))
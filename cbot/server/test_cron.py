@@ -0,0 +1,143 @@
+"""
+# test_cron.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import pickle
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import pycron
+
+from cbot.server.cron import CronAdmission, CronEntity, CronSchedule, CronScheduler
+from cbot.server.operation import Operation
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.fired = []
+        self.scheduler = CronScheduler(self.fired.append)
+
+    def test_next_after(self):
+        now = datetime(2022, 3, 14, 10, 17, 42)
+        self.assertEqual(CronSchedule('* * * * *').next_after(now),
+                         datetime(2022, 3, 14, 10, 18))
+        self.assertEqual(CronSchedule('0 * * * *').next_after(now),
+                         datetime(2022, 3, 14, 11, 0))
+        self.assertEqual(CronSchedule('30 8 * * mon').next_after(now),
+                         datetime(2022, 3, 21, 8, 30))
+        self.assertEqual(CronSchedule('0 0 1 1 *').next_after(now),
+                         datetime(2023, 1, 1, 0, 0))
+        self.assertEqual(CronSchedule('*/15 * * * * *').next_after(now),
+                         datetime(2022, 3, 14, 10, 17, 45))
+        self.assertIsNone(CronSchedule('0 0 30 2 *').next_after(now))
+
+    def test_matches_pycron(self):
+        now = datetime(2022, 2, 27, 22, 58, 0)
+        for schedule in ('* * * * *', '*/5 * * * *', '0 */2 * * *',
+                         '15,45 1-3 * * *', '0 0 * * 1-5', '0 12 */2 * *',
+                         '0 0 1 */3 *', '5 4 * * sun'):
+            cron = CronSchedule(schedule)
+            t = now
+            for _ in range(20):
+                t = cron.next_after(t)
+                self.assertTrue(pycron.is_now(schedule, t), f'{schedule} {t}')
+
+    def test_invalid(self):
+        for schedule in ('* * * *', '61 * * * *', '* * * * foo', '*/0 * * * *'):
+            with self.assertRaises(ValueError):
+                CronSchedule(schedule)
+
+    def test_scheduler(self):
+        now = datetime(2022, 3, 14, 10, 17, 42)
+        every_minute = CronEntity('* * * * *', Operation('ping'))
+        hourly = CronEntity('0 * * * *', Operation('ping'))
+        paused = CronEntity('* * * * *', Operation('ping'), is_paused=True)
+        self.scheduler.reschedule([hourly, every_minute, paused], now)
+        self.assertEqual(self.scheduler.get_delay(now), 18)
+        self.assertEqual(self.scheduler.pop_due(now), [])
+        self.assertEqual(self.scheduler.pop_due(datetime(2022, 3, 14, 10, 18)),
+                         [every_minute])
+        self.assertEqual(self.scheduler.pop_due(datetime(2022, 3, 14, 10, 18, 30)), [])
+
+        # forward clock jump: each entry fires once, not once per missed run
+        later = datetime(2022, 3, 14, 13, 30, 5)
+        self.assertEqual(set(self.scheduler.pop_due(later)), {every_minute, hourly})
+        self.assertEqual(every_minute.next_run, later.replace(minute=31, second=0))
+        self.assertEqual(hourly.next_run, datetime(2022, 3, 14, 14, 0))
+
+    def test_spread(self):
+        self.scheduler.spread = 10
+        now = datetime(2022, 3, 14, 10, 17, 42)
+        entries = [CronEntity('* * * * *', Operation('ping', [str(i)]))
+                   for i in range(20)]
+        self.scheduler.reschedule(entries, now)
+        offsets = [self.scheduler.get_offset(entry).total_seconds() for entry in entries]
+        self.assertTrue(all(0 <= offset < 10 for offset in offsets))
+        self.assertGreater(len(set(offsets)), 1)
+        self.assertEqual(offsets, [CronScheduler(None, spread=10).get_offset(entry)
+                                   .total_seconds() for entry in entries])
+
+        minute = datetime(2022, 3, 14, 10, 18)
+        due = self.scheduler.pop_due(minute + timedelta(seconds=5))
+        self.assertEqual(set(due), {e for e, o in zip(entries, offsets) if o <= 5})
+        due += self.scheduler.pop_due(minute + timedelta(seconds=10))
+        self.assertEqual(set(due), set(entries))
+        self.assertTrue(all(e.next_run == minute + timedelta(minutes=1) for e in entries))
+
+    def test_spread_modified_op(self):
+        self.scheduler.spread = 10
+        entry = CronEntity('* * * * *', Operation('ping', kwargs={'interval': '5'}))
+        self.scheduler.reschedule([entry], datetime(2022, 3, 14, 10, 17, 42))
+        entry.op.kwargs = {'interval': '10'}  # e.g. Task.modify_data
+        fired = []
+        for minute in range(18, 22):
+            fired += self.scheduler.pop_due(datetime(2022, 3, 14, 10, minute, 10))
+        self.assertEqual(fired, [entry] * 4)
+        self.assertEqual(len(self.scheduler.heap), 1)
+
+    def test_admission(self):
+        started = []
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            admission = CronAdmission(lambda op: started.append((op, loop.time())), rate=20)
+            t0 = loop.time()
+            for i in range(5):
+                admission.submit('binance', Operation('crypto_ticker', [str(i)]))
+            admission.submit('kraken', Operation('crypto_ticker'))
+            admission.submit(None, Operation('ping'))
+            self.assertEqual(len(started), 3)
+            await asyncio.sleep(0.3)
+            return t0
+
+        t0 = asyncio.run(run())
+        self.assertEqual(len(started), 7)
+        binance = [ts - t0 for op, ts in started if op.cmd == 'crypto_ticker' and op.args]
+        for i, delay in enumerate(binance):
+            self.assertAlmostEqual(delay, i * 0.05, delta=0.03)
+
+    def test_pickle(self):
+        entry = CronEntity('*/5 * * * *', Operation('ping'))
+        entry.next_run = datetime.now()
+        entry = pickle.loads(pickle.dumps(entry))
+        self.assertIsNone(entry.next_run)
+        self.assertEqual(entry.cron.minutes, list(range(0, 60, 5)))
+        self.assertEqual(entry.cron.next_after(datetime(2022, 1, 1, 0, 1)),
+                         datetime(2022, 1, 1, 0, 5))
@@ -0,0 +1,169 @@
+"""
+# test_event_bus.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+from unittest import TestCase
+
+from cbot.server.event_bus import Event, EventBus, OverflowPolicy
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.bus = EventBus()
+        self.received = []
+
+    async def listener(self, *args):
+        self.received.append(args)
+
+    async def slow_listener(self, *args):
+        await asyncio.sleep(0.01)
+        self.received.append(args)
+
+    def test_delivery_order(self):
+        async def run():
+            self.bus.add_listener(Event.LOGGER, self.listener)
+            for i in range(5):
+                self.bus.emit(Event.LOGGER, i)
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(0,), (1,), (2,), (3,), (4,)])
+
+    def test_all_listener_gets_event_name(self):
+        async def run():
+            self.bus.add_listener(Event.ALL, self.listener)
+            self.bus.emit(Event.TASK_FINISHED, {'taskId': 1})
+            await asyncio.sleep(0.01)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(Event.TASK_FINISHED, {'taskId': 1})])
+
+    def test_drop_oldest(self):
+        async def run():
+            self.bus.add_listener(Event.LOGGER, self.slow_listener,
+                                  maxsize=2, policy=OverflowPolicy.DROP_OLDEST)
+            for i in range(5):
+                self.bus.emit(Event.LOGGER, i)
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(3,), (4,)])
+        stats = self.bus.get_stats()[0]
+        self.assertEqual(stats['dropped'], 3)
+        self.assertEqual(stats['delivered'], 2)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_coalesce(self):
+        async def run():
+            self.bus.add_listener(Event.ALL, self.slow_listener,
+                                  maxsize=2, policy=OverflowPolicy.COALESCE)
+            self.bus.emit(Event.LOGGER, 'a')
+            for i in range(5):
+                self.bus.emit(Event.TICKER_UPDATE, i)
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(Event.LOGGER, 'a'),
+                                         (Event.TICKER_UPDATE, 4)])
+        self.assertEqual(self.bus.get_stats()[0]['coalesced'], 4)
+
+    def test_coalesce_non_snapshot(self):
+        async def run():
+            self.bus.add_listener(Event.ALL, self.slow_listener,
+                                  maxsize=2, policy=OverflowPolicy.COALESCE)
+            for i in range(4):
+                self.bus.emit(Event.TASK_FINISHED, {'taskId': i})
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(Event.TASK_FINISHED, {'taskId': 2}),
+                                         (Event.TASK_FINISHED, {'taskId': 3})])
+        stats = self.bus.get_stats()[0]
+        self.assertEqual((stats['coalesced'], stats['dropped']), (0, 2))
+
+    def test_block(self):
+        async def run():
+            self.bus.add_listener(Event.LOGGER, self.slow_listener, maxsize=1)
+            for i in range(3):
+                await self.bus.emit_wait(Event.LOGGER, i)
+                self.assertLessEqual(self.bus.get_stats()[0]['depth'], 1)
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(0,), (1,), (2,)])
+        self.assertEqual(self.bus.get_stats()[0]['overflows'], 0)
+
+    def test_block_sync_emit(self):
+        async def run():
+            self.bus.add_listener(Event.LOGGER, self.slow_listener, maxsize=2)
+            for i in range(5):
+                self.bus.emit(Event.LOGGER, i)
+                self.assertLessEqual(self.bus.get_stats()[0]['depth'], 2)
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(3,), (4,)])
+        self.assertEqual(self.bus.get_stats()[0]['overflows'], 3)
+
+    def test_remove_listener(self):
+        async def run():
+            self.bus.add_listener(Event.LOGGER, self.slow_listener)
+            self.bus.emit(Event.LOGGER, 1)
+            self.bus.remove_listener(Event.LOGGER, self.slow_listener)
+            self.bus.emit(Event.LOGGER, 2)
+            await asyncio.sleep(0.05)
+        asyncio.run(run())
+        self.assertEqual(self.received, [])
+        self.assertEqual(self.bus.listeners, {})
+
+    def test_coalescing_window(self):
+        async def run():
+            self.bus.set_coalescing(Event.TICKER_UPDATE, 0.02)
+            self.bus.add_listener(Event.TICKER_UPDATE, self.listener)
+            for i in range(10):
+                self.bus.emit(Event.TICKER_UPDATE, i)
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.received, [])
+            await asyncio.sleep(0.03)
+            self.bus.emit(Event.TICKER_UPDATE, 10)
+            await asyncio.sleep(0.03)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(9,), (10,)])
+
+    def test_coalescing_loop_tick(self):
+        async def run():
+            self.bus.set_coalescing(Event.TICKER_UPDATE)
+            self.bus.add_listener(Event.ALL, self.slow_listener)
+            for i in range(10):
+                self.bus.emit(Event.TICKER_UPDATE, i)
+            self.bus.emit(Event.LOGGER, 'a')
+            await asyncio.sleep(0)
+            for i in range(10, 20):
+                self.bus.emit(Event.TICKER_UPDATE, i)
+            await asyncio.sleep(0.1)
+        asyncio.run(run())
+        self.assertEqual(self.received, [(Event.LOGGER, 'a'),
+                                         (Event.TICKER_UPDATE, 19)])
+
+    def test_batching(self):
+        async def run():
+            self.bus.set_batching(Event.LOGGER, 0.02, max_size=3)
+            self.bus.add_listener(Event.LOGGER, self.listener)
+            for i in range(4):
+                self.bus.emit(Event.LOGGER, i)
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.received, [([0, 1, 2],)])
+            await asyncio.sleep(0.03)
+        asyncio.run(run())
+        self.assertEqual(self.received, [([0, 1, 2],), ([3],)])
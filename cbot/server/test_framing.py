@@ -0,0 +1,45 @@
+"""
+# test_framing.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from unittest import TestCase
+
+from cbot.server.framing import FrameDecoder, FramingError, HEADER, encode_frame
+
+
+class Test(TestCase):
+
+    def test_frames(self):
+        decoder = FrameDecoder()
+        stream = encode_frame(b'{"a": 1}') + encode_frame(b'') + encode_frame(b'[2]')
+        messages = []
+        for i in range(len(stream)):  # byte by byte
+            messages.extend(decoder.feed(stream[i:i + 1]))
+        self.assertFalse(decoder.line_mode)
+        self.assertEqual(messages, [b'{"a": 1}', b'[2]'])
+        self.assertEqual(decoder.buffer, b'')
+
+    def test_line_mode(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(b'{"a": 1}\r\n{"b"'), [b'{"a": 1}'])
+        self.assertTrue(decoder.line_mode)
+        self.assertEqual(decoder.feed(b': 2}\r\n\r\n'), [b'{"b": 2}'])
+
+    def test_too_large(self):
+        decoder = FrameDecoder()
+        self.assertRaises(FramingError, decoder.feed, HEADER.pack(2 ** 31))
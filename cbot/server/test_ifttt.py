@@ -0,0 +1,107 @@
+"""
+# test_ifttt.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import pickle
+from unittest import TestCase
+
+from cbot.server.ifttt import IftttEntity, IftttIndex
+from cbot.server.operation import Operation
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.tickers = {
+            'binance': {
+                'BTC/USDT': {'last': 50000},
+                'ETH/USDT': {'last': 3000},
+            },
+        }
+
+    def test_refs(self):
+        entry = IftttEntity("binance['BTC/USDT']['last'] > 40000 and "
+                            "float(kraken['ETH/EUR']['last']) < 3000",
+                            Operation('ping'))
+        self.assertEqual(entry.refs, {('binance', 'BTC/USDT'),
+                                      ('kraken', 'ETH/EUR')})
+        entry = IftttEntity("len(binance) > 1", Operation('ping'))
+        self.assertEqual(entry.refs, {('binance', None)})
+
+    def test_evaluate(self):
+        entry = IftttEntity("binance['BTC/USDT']['last'] > 40000", Operation('ping'))
+        self.assertTrue(entry.evaluate(self.tickers))
+        entry = IftttEntity("binance['ETH/USDT']['last'] > 4000", Operation('ping'))
+        self.assertFalse(entry.evaluate(self.tickers))
+
+    def test_invalid_condition(self):
+        with self.assertRaises(SyntaxError):
+            IftttEntity("binance['BTC/USDT'] >", Operation('ping'))
+
+    def test_index_lookup(self):
+        index = IftttIndex()
+        btc = IftttEntity("binance['BTC/USDT']['last'] > 1 and True", Operation('ping'))
+        eth = IftttEntity("binance['ETH/USDT']['last'] > 1 and True", Operation('ping'))
+        board = IftttEntity("len(binance) > 100", Operation('ping'))
+        anything = IftttEntity("True", Operation('ping'))
+        for entry in (btc, eth, board, anything):
+            index.add(entry)
+        self.assertEqual(index.lookup([('binance', 'BTC/USDT')]),
+                         [btc, board, anything])
+        self.assertEqual(index.lookup([('kraken', 'BTC/USDT')]), [anything])
+        index.remove(btc)
+        index.remove(anything)
+        self.assertEqual(index.lookup([('binance', 'BTC/USDT')]), [board])
+        self.assertEqual(len(index), 2)
+
+    def test_price_trigger_parse(self):
+        entry = IftttEntity("binance['BTC/USDT']['last'] > 40000", Operation('ping'))
+        self.assertEqual(entry.trigger, ('binance', 'BTC/USDT', '>', 40000.0))
+        entry = IftttEntity("-1.5 >= float(binance['BTC/USDT']['last'])", Operation('ping'))
+        self.assertEqual(entry.trigger, ('binance', 'BTC/USDT', '<=', -1.5))
+        entry = IftttEntity("binance['BTC/USDT']['bid'] > 40000", Operation('ping'))
+        self.assertIsNone(entry.trigger)
+        entry = IftttEntity("1 < binance['BTC/USDT']['last'] < 2", Operation('ping'))
+        self.assertIsNone(entry.trigger)
+
+    def test_price_trigger_lookup(self):
+        index = IftttIndex()
+        entries = {}
+        for cond in ('> 100', '>= 110', '< 90', '<= 80', '> 120'):
+            entries[cond] = IftttEntity(f"binance['BTC/USDT']['last'] {cond}",
+                                        Operation('ping'))
+            index.add(entries[cond])
+        changed = [('binance', 'BTC/USDT')]
+        self.tickers['binance']['BTC/USDT']['last'] = 100
+        self.assertEqual(index.lookup(changed, self.tickers), [])
+        self.tickers['binance']['BTC/USDT']['last'] = 110
+        self.assertEqual(index.lookup(changed, self.tickers),
+                         [entries['> 100'], entries['>= 110']])
+        index.remove(entries['> 100'])
+        self.tickers['binance']['BTC/USDT']['last'] = 80
+        self.assertEqual(index.lookup(changed, self.tickers),
+                         [entries['< 90'], entries['<= 80']])
+        for entry in entries.values():
+            index.remove(entry)
+        self.assertEqual(index.by_price, {})
+
+    def test_pickle(self):
+        entry = IftttEntity("binance['BTC/USDT']['last'] > 40000", Operation('ping'))
+        entry = pickle.loads(pickle.dumps(entry))
+        self.assertTrue(entry.evaluate(self.tickers))
+        self.assertEqual(entry.refs, {('binance', 'BTC/USDT')})
@@ -0,0 +1,72 @@
+"""
+# test_live_board.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from unittest import TestCase
+
+from cbot.server.live_board import LiveBoard
+
+
+def row(symbol, change):
+    return {'s': symbol, '5m': change}
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.board = LiveBoard()
+
+    def symbols(self):
+        return [r['s'] for r in self.board.rows]
+
+    def test_deltas(self):
+        self.assertTrue(self.board.update(row('A', 1))['full'])
+        delta = self.board.update(row('B', 2))
+        self.assertEqual(delta, {'version': 2, 'full': False,
+                                 'rows': [row('B', 2)], 'moves': [['B', 0]]})
+        self.board.update(row('C', 0))
+        self.assertEqual(self.symbols(), ['B', 'A', 'C'])
+
+        delta = self.board.update(row('A', 1.5))
+        self.assertEqual(delta['moves'], [])
+        delta = self.board.update(row('C', 3))
+        self.assertEqual(delta['moves'], [['C', 0]])
+        self.assertEqual(self.symbols(), ['C', 'B', 'A'])
+        self.assertEqual(len(self.board), 3)
+
+    def test_apply(self):
+        """Applying deltas the way the web client does rebuilds the board"""
+        client = self.board.update(row('A', 1))['rows']
+        for symbol, change in (('B', 2), ('C', 0), ('A', 3), ('B', -1), ('D', 1), ('C', 0)):
+            delta = self.board.update(row(symbol, change))
+            for r in delta['rows']:
+                for i, c in enumerate(client):
+                    if c['s'] == r['s']:
+                        client[i] = r
+            for symbol_moved, rank in delta['moves']:
+                moved = [c for c in client if c['s'] == symbol_moved]
+                client = [c for c in client if c['s'] != symbol_moved]
+                client.insert(rank, moved[0] if moved else delta['rows'][0])
+        self.assertEqual(client, self.board.rows)
+
+    def test_keyframe(self):
+        self.board.KEYFRAME_INTERVAL = 0
+        self.board.update(row('A', 1))
+        delta = self.board.update(row('B', 2))
+        self.assertEqual(delta, {'version': 2, 'full': True,
+                                 'rows': [row('B', 2), row('A', 1)]})
@@ -0,0 +1,56 @@
+"""
+# test_ring_buffer.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from unittest import TestCase
+
+from cbot.server.ring_buffer import RingBuffer
+
+
+def msgs(lines):
+    return [line['msg'] for line in lines]
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.buf = RingBuffer(4)
+        for i in range(6):
+            self.buf.append({'msg': i})
+
+    def test_tail(self):
+        self.assertEqual(len(self.buf), 4)
+        self.assertEqual(msgs(self.buf), [2, 3, 4, 5])
+        self.assertEqual(msgs(self.buf.tail(2)), [4, 5])
+        self.assertEqual(msgs(self.buf.tail(10)), [2, 3, 4, 5])
+        self.assertEqual([line['seq'] for line in self.buf], [3, 4, 5, 6])
+
+    def test_since(self):
+        self.assertEqual(msgs(self.buf.since(0)), [2, 3, 4, 5])
+        self.assertEqual(msgs(self.buf.since(4)), [4, 5])
+        self.assertEqual(msgs(self.buf.since(4, 1)), [4])
+        self.assertEqual(self.buf.since(6), [])
+        self.buf.append({'msg': 6})
+        self.assertEqual(msgs(self.buf.since(6)), [6])
+
+    def test_restore(self):
+        buf = RingBuffer(4, self.buf.tail())
+        self.assertEqual(buf.seq, 6)
+        self.assertEqual(msgs(buf.since(5)), [5])
+        buf = RingBuffer(4, [{'msg': 'a'}, {'msg': 'b'}])
+        self.assertEqual(msgs(buf.since(1)), ['b'])
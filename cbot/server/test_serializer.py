@@ -0,0 +1,66 @@
+"""
+# test_serializer.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+from cbot.server import serializer
+from cbot.server.cron import CronEntity
+from cbot.server.event_bus import Event
+from cbot.server.operation import Operation
+
+PAYLOAD = {
+    'price': Decimal('7.5021'),
+    'event': Event.LOGGER,
+    'ts': datetime(2022, 3, 14, 10, 17, 42),
+    'cron': CronEntity('*/5 * * * *', Operation('ping')),
+    'ids': {3},
+    1: [None, True, 1.5],
+}
+
+EXPECTED = {
+    'price': '7.5021',
+    'event': 'LOGGER',
+    'ts': '2022-03-14 10:17:42',
+    'cron': str(CronEntity('*/5 * * * *', Operation('ping'))),
+    'ids': [3],
+    '1': [None, True, 1.5],
+}
+
+
+class Test(TestCase):
+
+    def tearDown(self) -> None:
+        serializer.use_backend()
+
+    def test_backends(self):
+        for backend in serializer.BACKENDS:
+            if backend == 'orjson' and not serializer.orjson:
+                continue
+            serializer.use_backend(backend)
+            encoded = serializer.dumps(PAYLOAD)
+            self.assertIsInstance(encoded, str)
+            self.assertEqual(json.loads(encoded), EXPECTED)
+            self.assertEqual(serializer.loads(encoded), EXPECTED)
+        self.assertRaises(ValueError, serializer.use_backend, 'nope')
+
+    def test_big_int(self):
+        self.assertEqual(serializer.dumps([2 ** 70]), '[%d]' % 2 ** 70)
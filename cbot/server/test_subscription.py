@@ -0,0 +1,83 @@
+"""
+# test_subscription.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from unittest import TestCase
+
+from cbot.server.event_bus import Event
+from cbot.server.subscription import Subscription
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.sub = Subscription()
+
+    def test_default_all(self):
+        self.assertEqual(self.sub.select(Event.LOGGER, [1]), (None, [1]))
+        self.sub.unsubscribe(['LOGGER'])
+        self.assertEqual(self.sub.select(Event.LOGGER, [1]), (None, None))
+        self.assertEqual(self.sub.select(Event.TASK_INFO, {}), (None, {}))
+
+    def test_subscribe(self):
+        self.sub.subscribe(['BIN_LIVE_UPDATE'])
+        self.assertIsNone(self.sub.select(Event.LOGGER, [1])[1])
+        self.assertEqual(self.sub.select(Event.BIN_LIVE_UPDATE, [1])[1], [1])
+        self.sub.unsubscribe(['BIN_LIVE_UPDATE'])
+        self.assertIsNone(self.sub.select(Event.BIN_LIVE_UPDATE, [1])[1])
+        self.assertRaises(ValueError, self.sub.subscribe, ['NOPE'])
+        self.assertRaises(ValueError, self.sub.subscribe, ['LOGGER'], {'nope': 1})
+
+    def test_filters(self):
+        self.sub.subscribe(['LOGGER', 'CRYPTO_TSL_UPDATE'], {'taskId': 2})
+        key, data = self.sub.select(Event.LOGGER, [{'taskId': 1}, {'taskId': 2}])
+        self.assertEqual(data, [{'taskId': 2}])
+        self.assertIsNotNone(key)
+        self.assertIsNone(self.sub.select(Event.LOGGER, [{'taskId': 1}])[1])
+        self.assertIsNone(self.sub.select(Event.CRYPTO_TSL_UPDATE, {'taskId': 1})[1])
+
+        self.sub.subscribe(['TICKER_UPDATE', 'STREAM_TICKERS'], {'symbol': 'BTC/USDT'})
+        tickers = {'binance': {'BTC/USDT': 1, 'ETH/USDT': 2}}
+        self.assertEqual(self.sub.select(Event.TICKER_UPDATE, tickers)[1],
+                         {'binance': {'BTC/USDT': 1}})
+        self.assertEqual(self.sub.select(Event.STREAM_TICKERS, [{'s': 'BTC/USDT'}])[1],
+                         [{'s': 'BTC/USDT'}])
+
+    def test_bin_live_filter(self):
+        self.sub.subscribe(['BIN_LIVE_UPDATE'], {'symbol': 'AUSDT,DUSDT'})
+        delta = {'version': 5, 'full': False, 'rows': [{'s': 'AUSDT', '5m': 1}],
+                 'moves': [['AUSDT', 2]]}
+        self.assertEqual(self.sub.select(Event.BIN_LIVE_UPDATE, delta)[1],
+                         {'version': 5, 'full': False, 'rows': [{'s': 'AUSDT', '5m': 1}]})
+        delta = dict(delta, version=6, rows=[{'s': 'BUSDT', '5m': 2}], moves=[])
+        self.assertEqual(self.sub.select(Event.BIN_LIVE_UPDATE, delta)[1],
+                         {'version': 6, 'full': False, 'rows': []})
+
+    def test_shared_key(self):
+        other = Subscription()
+        self.sub.subscribe(['LOGGER'], {'taskId': '1,2'})
+        other.subscribe(['LOGGER'], {'taskId': [2, 1]})
+        data = [{'taskId': 1}]
+        self.assertEqual(self.sub.select(Event.LOGGER, data)[0],
+                         other.select(Event.LOGGER, data)[0])
+
+    def test_wants(self):
+        self.assertTrue(self.sub.wants(Event.TASK_MANAGER))
+        self.sub.subscribe(['LOGGER'], {'taskId': 1})
+        self.assertTrue(self.sub.wants(Event.LOGGER))
+        self.assertFalse(self.sub.wants(Event.TASK_MANAGER))
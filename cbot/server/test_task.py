@@ -0,0 +1,89 @@
+"""
+# test_task.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+from unittest import TestCase
+
+from cbot.server.operation import Operation
+from cbot.server.task import Task
+
+
+async def job_idle(_task: Task):
+    await asyncio.sleep(3600)
+
+
+class Test(TestCase):
+
+    def test_info_cache(self):
+        async def run():
+            task = Task(Operation('idle', kwargs={'desc': 'a'}), job_idle, name='idle')
+            await asyncio.sleep(0)
+            info = task.to_info_dict()
+            encoded = task.to_info_json()
+            self.assertIs(task.to_info_dict(), info)
+            self.assertIs(task.to_info_json(), encoded)
+            self.assertEqual(json.loads(encoded), info)
+
+            task.pause()
+            self.assertIsNot(task.to_info_dict(), info)
+            self.assertTrue(json.loads(task.to_info_json())['is_paused'])
+
+            task.modify_data({'desc': 'b'})
+            self.assertEqual(task.to_info_dict()['desc'], 'b')
+            task.kill()
+            self.assertTrue(task.to_info_dict()['is_finished'])
+        asyncio.run(run())
+
+    def test_response_json(self):
+        op = Operation('ps')
+        op.output = ['#1']
+        op.data_json_items = ['{"id": 1}']
+        self.assertEqual(json.loads(op.to_response_json()), {
+            'resp_code': 'OK', 'output': ['#1'], 'data': [{'id': 1}]})
+        self.assertEqual(json.loads(op.to_stream_response_json()), {
+            'stream': 'RESULT',
+            'data': {'cmd': 'ps', 'resp_code': 'OK', 'output': ['#1'],
+                     'data': [{'id': 1}]}})
+        op.request_id = 'r1'
+        self.assertEqual(json.loads(op.to_stream_response_json())['data']['id'], 'r1')
+        op.data_json_items = None
+        op.data = {'x': 1}
+        self.assertEqual(json.loads(op.to_response_json())['data'], {'x': 1})
+
+    def test_iter_response_json(self):
+        op = Operation('get')
+        op.data = list(range(5))
+        self.assertEqual([json.loads(p) for p in op.iter_response_json(2)], [
+            {'resp_code': 'OK', 'output': '', 'data': [0, 1], 'more': True},
+            {'data': [2, 3], 'more': True},
+            {'data': [4], 'more': False},
+        ])
+        self.assertEqual(list(op.iter_response_json(5)), [op.to_response_json()])
+        op.data = None
+        op.request_id = 7
+        op.data_json_items = ['{"id":%d}' % i for i in range(3)]
+        self.assertEqual([json.loads(p) for p in op.iter_response_json(2)], [
+            {'resp_code': 'OK', 'output': '', 'id': 7, 'data': [{'id': 0}, {'id': 1}],
+             'more': True},
+            {'id': 7, 'data': [{'id': 2}], 'more': False},
+        ])
+        op.data = {'x': list(range(5))}
+        op.data_json_items = None
+        self.assertEqual(list(op.iter_response_json(2)), [op.to_response_json()])
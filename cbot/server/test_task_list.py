@@ -0,0 +1,86 @@
+"""
+# test_task_list.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+from unittest import TestCase
+
+from cbot.server import serializer
+from cbot.server.event_bus import event_bus, Event
+from cbot.server.operation import Operation
+from cbot.server.task import Task
+from cbot.server.task_manager import TaskManager
+from cbot.server.test_task import job_idle
+
+
+class Test(TestCase):
+
+    def test_diffs(self):
+        diffs = []
+
+        async def on_diff(diff):
+            diffs.append(diff)
+
+        async def settle():
+            await asyncio.sleep(manager.task_list_model.DEBOUNCE * 2)
+
+        async def run():
+            event_bus.add_listener(Event.TASK_MANAGER, on_diff)
+            try:
+                for name in ('a', 'b'):
+                    manager.add(Task(Operation(name), job_idle, name=name))
+                await settle()
+                manager.pause_task(1)
+                await settle()
+                manager.kill_all()
+                await settle()
+                manager.clean()
+                await settle()
+                manager.clean()
+                await settle()
+            finally:
+                event_bus.remove_listener(Event.TASK_MANAGER, on_diff)
+
+        manager = TaskManager()
+        asyncio.run(run())
+        self.assertEqual([d['version'] for d in diffs], [1, 2, 3, 4])
+        self.assertFalse(any(d['full'] for d in diffs))
+        self.assertEqual([t['id'] for t in diffs[0]['added']], [1, 2])
+        self.assertEqual([t['id'] for t in diffs[1]['changed']], [1])
+        self.assertEqual([t['id'] for t in diffs[2]['changed']], [1, 2])
+        self.assertEqual((diffs[3]['added'], diffs[3]['changed'], diffs[3]['removed']),
+                         ([], [], [1, 2]))
+
+    def test_snapshot(self):
+        async def run():
+            for name in ('a', 'b'):
+                manager.add(Task(Operation(name, ['1'], {'x': '2'}), job_idle, name=name))
+            manager.cron_list.append('* * * * * ping')
+            manager.task_list_model.mark_lists()
+            await asyncio.sleep(0)
+            snapshot = manager.task_list_model.snapshot()
+            self.assertEqual(snapshot['version'], 1)
+            self.assertTrue(snapshot['full'])
+            self.assertEqual(snapshot['cron_list'], ['* * * * * ping'])
+            self.assertEqual(json.loads(manager.task_list_model.snapshot_json()),
+                             json.loads(serializer.dumps(snapshot)))
+            manager.kill_all()
+
+        manager = TaskManager()
+        asyncio.run(run())
@@ -0,0 +1,152 @@
+"""
+# test_task_manager.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+import pickle
+from unittest import TestCase
+
+from cbot.server.operation import Operation
+from cbot.server.task import Task, TaskState
+from cbot.server.task_manager import TaskIndex, TaskManager
+from cbot.server.test_task import job_idle
+from cbot.server.tasks.job_ping import job_ping
+
+
+class Test(TestCase):
+
+    def test_task_index(self):
+        changed = []
+
+        async def run():
+            index = TaskIndex(on_change=changed.append)
+            tasks = []
+            for task_id, name in enumerate(('a', 'b', 'a'), 1):
+                task = Task(Operation(name), job_idle, name=name)
+                task.id = task_id
+                index.add(task)
+                tasks.append(task)
+            await asyncio.sleep(0)
+
+            def ids(tasks):
+                return [t.id for t in tasks]
+            self.assertEqual(ids(index), [1, 2, 3])
+            self.assertEqual(ids(index.select('a')), [1, 3])
+            self.assertEqual(ids(index.select('c')), [])
+            self.assertEqual(ids(index.select(state=TaskState.RUNNING)), [1, 2, 3])
+
+            tasks[1].pause()
+            tasks[2].kill()
+            self.assertEqual(changed, [tasks[1], tasks[2]])
+            self.assertEqual(ids(index.select(state=TaskState.PAUSED)), [2])
+            self.assertEqual(ids(index.select('a', TaskState.RUNNING)), [1])
+            self.assertEqual(ids(index.select('a', TaskState.FINISHED)), [3])
+            self.assertEqual(index.count(), {'running': 1, 'paused': 1, 'finished': 1})
+
+            index.remove(tasks[0])
+            self.assertEqual(ids(index.select('a')), [3])
+            self.assertIs(index.last(), tasks[2])
+            self.assertIsNone(index.get(1))
+            tasks[0].kill()
+            self.assertEqual(len(changed), 2)
+            tasks[1].kill()
+        asyncio.run(run())
+
+    def test_clean(self):
+        async def run():
+            manager = TaskManager()
+            for name in ('a', 'b', 'c'):
+                manager.add(Task(Operation(name), job_idle, name=name))
+            await asyncio.sleep(0)
+            manager.kill(1)
+            manager.kill(3)
+            manager.clean()
+            self.assertEqual([t.id for t in manager.tasks], [2])
+            self.assertEqual(manager.tasks.count()['finished'], 0)
+            manager.kill_all()
+        asyncio.run(run())
+
+    def test_savegame(self):
+        async def run():
+            manager = TaskManager()
+            for _ in range(3):
+                manager.add(Task(Operation('ping', kwargs={'interval': '60'}),
+                                 job_ping, name='ping'))
+            await asyncio.sleep(0)
+            manager.pause_task(2)
+            manager.kill(3)
+            data = pickle.loads(pickle.dumps(manager.to_savegame()))
+            manager.kill_all()
+
+            restored = TaskManager()
+            restored.from_savegame(data)
+            self.assertEqual(restored.counter, 3)
+            self.assertEqual([(t.id, t.name, t.state) for t in restored.tasks], [
+                (1, 'ping', TaskState.RUNNING),
+                (2, 'ping', TaskState.PAUSED),
+                (3, 'ping', TaskState.FINISHED),
+            ])
+            self.assertEqual([t.id for t in restored.tasks.select('ping', TaskState.PAUSED)], [2])
+            restored.kill_all()
+        asyncio.run(run())
+
+    def test_merged_output(self):
+        async def run():
+            manager = TaskManager()
+            for name, ts_list in (('a', (1, 4, 5)), ('b', (2, 3, 6))):
+                task = Task(Operation(name), job_idle, name=name)
+                manager.add(task)
+                for ts in ts_list:
+                    level = 'error' if ts == 3 else 'info'
+                    task.output.append({'ts': ts, 'taskId': task.id,
+                                        'level': level, 'msg': ts})
+            await asyncio.sleep(0)
+
+            def stamps(**kwargs):
+                return [x['ts'] for x in manager.get_merged_output(**kwargs)]
+            self.assertEqual(stamps(), [1, 2, 3, 4, 5, 6])
+            self.assertEqual(stamps(limit=2), [5, 6])
+            self.assertEqual(stamps(num=1), [5, 6])
+            self.assertEqual(stamps(since_ts=3), [4, 5, 6])
+            self.assertEqual(stamps(since=2), [5, 6])
+            self.assertEqual(stamps(name='b'), [2, 3, 6])
+            self.assertEqual(stamps(level='error'), [3])
+            self.assertEqual(stamps(), [x['ts'] for x in manager.get_output(-1)])
+            for task in manager.tasks:
+                task.kill()
+        asyncio.run(run())
+
+    def test_batch(self):
+        async def run():
+            manager = TaskManager()
+            request = {'id': 7, 'cmd': 'batch', 'kwargs': {}, 'args': [
+                {'cmd': 'ps', 'args': [], 'kwargs': {}},
+                {'cmd': 'batch', 'args': [], 'kwargs': {}},
+                {'args': []},
+                'ps',
+                {'cmd': 'reload', 'args': [], 'kwargs': {}},
+                {'cmd': 'ps', 'args': [], 'kwargs': {}},
+            ]}
+            op = await manager.process_request(json.dumps(request))
+            res = json.loads(op.to_response_json())
+            self.assertEqual(res['id'], 7)
+            self.assertEqual([x['resp_code'] for x in res['data']],
+                             ['OK', 'ERR', 'ERR', 'ERR', 'ERR', 'OK'])
+            self.assertEqual(res['data'][0]['data'], [])
+        asyncio.run(run())
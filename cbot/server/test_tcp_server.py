@@ -0,0 +1,149 @@
+"""
+# test_tcp_server.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase, skipUnless
+
+from cbot.server import serializer
+from cbot.server.event_bus import event_bus, Event
+from cbot.server.framing import FrameDecoder, encode_frame
+from cbot.server.tcp_server import Server
+
+
+class Test(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.server = Server('127.0.0.1', 0, max_connections=2, idle_timeout=0.2,
+                             unix_socket=os.path.join(self.tmpdir.name, 'cbot.sock'))
+        await self.server.run()
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    async def call(reader, writer, cmd, args=(), kwargs=None):
+        request = {'cmd': cmd, 'args': args, 'kwargs': kwargs or {}}
+        writer.write(encode_frame(json.dumps(request).encode('utf8')))
+        return await Test.recv(reader)
+
+    @staticmethod
+    async def recv(reader):
+        decoder = FrameDecoder()
+        decoder.line_mode = False
+        messages = []
+        while not messages:
+            messages = decoder.feed(await reader.read(65536))
+        return json.loads(messages[0])
+
+    async def test_tcp_and_unix(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.assertEqual((await self.call(reader, writer, 'ps'))['resp_code'], 'OK')
+        writer.close()
+        self.assertEqual(os.stat(self.server.unix_socket).st_mode & 0o777, 0o600)
+        reader, writer = await asyncio.open_unix_connection(self.server.unix_socket)
+        self.assertEqual((await self.call(reader, writer, 'ps'))['resp_code'], 'OK')
+        writer.close()
+
+    async def test_pipelining(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        for i in range(20):
+            request = {'id': i, 'cmd': 'ps', 'args': [], 'kwargs': {}}
+            writer.write(encode_frame(json.dumps(request).encode('utf8')))
+        decoder = FrameDecoder()
+        decoder.line_mode = False
+        responses = []
+        while len(responses) < 20:
+            responses.extend(decoder.feed(await reader.read(65536)))
+        self.assertEqual(sorted(json.loads(x)['id'] for x in responses),
+                         list(range(20)))
+        writer.close()
+
+    async def test_request_error(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        for i, cmd in enumerate(('reload', 'ps')):
+            request = {'id': i, 'cmd': cmd, 'args': [], 'kwargs': {}}
+            writer.write(encode_frame(json.dumps(request).encode('utf8')))
+        decoder = FrameDecoder()
+        decoder.line_mode = False
+        responses = []
+        while len(responses) < 2:
+            responses.extend(map(json.loads, decoder.feed(await reader.read(65536))))
+        self.assertEqual(sorted((x['id'], x['resp_code']) for x in responses),
+                         [(0, 'ERR'), (1, 'OK')])
+        res = await self.call(reader, writer, 'reload')
+        self.assertEqual(res['resp_code'], 'ERR')
+        writer.close()
+
+    async def test_subscribe(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        res = await self.call(reader, writer, 'unsubscribe', ['ALL'])
+        self.assertEqual(res['output'], 'Not subscribed')
+        res = await self.call(reader, writer, 'subscribe',
+                              ['TASK_FINISHED'], {'taskId': '2'})
+        self.assertEqual(res['output'], 'Subscribed: TASK_FINISHED')
+        event_bus.emit(Event.TASK_MODIFIED, {'taskId': 2})
+        event_bus.emit(Event.TASK_FINISHED, {'taskId': 1})
+        event_bus.emit(Event.TASK_FINISHED, {'taskId': 2})
+        msg = await asyncio.wait_for(self.recv(reader), 2)
+        self.assertEqual(msg, {'stream': 'TASK_FINISHED', 'data': {'taskId': 2}})
+        await asyncio.sleep(self.server.idle_timeout * 2)
+        self.assertEqual(len(self.server.subscribers), 1)
+        writer.close()
+
+    @skipUnless(serializer.msgpack, 'msgpack is not installed')
+    async def test_msgpack(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        res = await self.call(reader, writer, 'encoding', ['msgpack'])
+        self.assertEqual(res['output'], 'Encoding: msgpack')
+        request = {'id': 1, 'cmd': 'subscribe', 'args': ['TASK_FINISHED'], 'kwargs': {}}
+        writer.write(encode_frame(serializer.packb(request)))
+        decoder = FrameDecoder()
+        decoder.line_mode = False
+        messages = []
+        while not messages:
+            messages = decoder.feed(await reader.read(65536))
+        self.assertEqual(serializer.unpackb(messages[0])['id'], 1)
+        event_bus.emit(Event.TASK_FINISHED, {'taskId': 2})
+        while len(messages) < 2:
+            messages.extend(decoder.feed(await reader.read(65536)))
+        self.assertEqual(serializer.unpackb(messages[1]),
+                         {'stream': 'TASK_FINISHED', 'data': {'taskId': 2}})
+        writer.close()
+
+    async def test_max_connections(self):
+        clients = [await asyncio.open_connection('127.0.0.1', self.port)
+                   for _ in range(3)]
+        self.assertEqual(await clients[2][0].read(), b'')
+        self.assertEqual(self.server.get_stats()['refused'], 1)
+        self.assertEqual(len(self.server.clients), 2)
+        for _, writer in clients:
+            writer.close()
+
+    async def test_idle_timeout(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        self.assertEqual(await asyncio.wait_for(reader.read(), 2), b'')
+        self.assertEqual(len(self.server.clients), 0)
+        writer.close()
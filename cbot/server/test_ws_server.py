@@ -0,0 +1,122 @@
+"""
+# test_ws_server.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import json
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+import websockets
+
+from cbot.server.connection import Connection
+from cbot.server.event_bus import event_bus, Event
+from cbot.server.memstore import memstore
+from cbot.server.ws_server import Server
+
+
+async def send(_payload):
+    pass
+
+
+class Test(TestCase):
+
+    def setUp(self) -> None:
+        self.server = Server('127.0.0.1')
+        self.con = Connection('test', send)
+        memstore.add('bin_live', [{'s': 'BTCUSDT', '5m': 1.5}])
+
+    def tearDown(self) -> None:
+        del memstore.store['bin_live']
+
+    def get_snapshot(self):
+        self.assertEqual(len(self.con.queue), 1)
+        frame = json.loads(self.con.queue[0][1])
+        self.assertEqual(frame['stream'], 'BATCH')
+        return {f['stream']: f['data'] for f in frame['data']}
+
+    def test_snapshot(self):
+        self.server.send_snapshot(self.con)
+        snapshot = self.get_snapshot()
+        self.assertTrue(snapshot['TASK_MANAGER']['full'])
+        self.assertEqual(snapshot['BIN_LIVE_UPDATE'], {
+            'version': 0, 'full': True, 'rows': [{'s': 'BTCUSDT', '5m': 1.5}]})
+
+    def test_snapshot_subscribed(self):
+        self.con.subscription.subscribe(['BIN_LIVE_UPDATE'], {'symbol': 'ETHUSDT'})
+        self.server.send_snapshot(self.con)
+        self.assertEqual(self.get_snapshot()['BIN_LIVE_UPDATE']['rows'], [])
+        self.con.queue.clear()
+        self.con.subscription.subscribe(['STREAM_TICKERS'])
+        self.server.send_snapshot(self.con, [Event.STREAM_TICKERS])
+        self.assertEqual(len(self.con.queue), 0)
+
+
+class SlowServer(Server):
+    """Delays requests by their `sleep` kwarg and tracks how many run"""
+    MAX_IN_FLIGHT = 2
+    active = 0
+    max_active = 0
+
+    async def run_request(self, con, op, data):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(float(op.kwargs.pop('sleep', 0)))
+        finally:
+            self.active -= 1
+        await super().run_request(con, op, data)
+
+
+class TestRequests(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.server = SlowServer('127.0.0.1', 0)
+        await self.server.run()
+        port = list(self.server.server.sockets)[0].getsockname()[1]
+        self.ws = await websockets.connect(f'ws://127.0.0.1:{port}')
+
+    async def asyncTearDown(self) -> None:
+        await self.ws.close()
+        self.server.close()
+        await self.server.wait_closed()
+        event_bus.remove_listener(Event.ALL, self.server.event_to_all)
+
+    async def send(self, request_id, sleep):
+        await self.ws.send(json.dumps({'id': request_id, 'cmd': 'ps', 'args': [],
+                                       'kwargs': {'sleep': sleep}}))
+
+    async def results(self, num):
+        ids = []
+        while len(ids) < num:
+            frame = json.loads(await asyncio.wait_for(self.ws.recv(), 2))
+            frames = frame['data'] if frame['stream'] == 'BATCH' else [frame]
+            ids += [f['data']['id'] for f in frames if f['stream'] == 'RESULT']
+        return ids
+
+    async def test_slow_request(self):
+        await self.send('slow', 0.2)
+        await self.send('fast', 0)
+        self.assertEqual(await self.results(2), ['fast', 'slow'])
+
+    async def test_max_in_flight(self):
+        for i in range(4):
+            await self.send(i, 0.05 * (4 - i))
+        ids = await self.results(4)
+        self.assertEqual(ids[:2], [1, 0])  # completion order
+        self.assertEqual(sorted(ids), [0, 1, 2, 3])
+        self.assertEqual(self.server.max_active, 2)
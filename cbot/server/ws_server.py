@@ -18,48 +18,61 @@
 """
 
 import asyncio
-import json
 from contextlib import suppress
-from decimal import Decimal
-from typing import Set, Any
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from websockets.server import serve as ws_serve
 from websockets.exceptions import ConnectionClosedError
 from websockets.legacy.server import WebSocketServerProtocol, WebSocketServer
 
-from cbot.server.event_bus import event_bus, Event
+from cbot.server import serializer
+from cbot.server.codec import get_codec
+from cbot.server.connection import Connection, RequestDispatcher, broadcast, process_subscription
+from cbot.server.event_bus import event_bus, Event, OverflowPolicy
 from cbot.server.logger import logger
+from cbot.server.memstore import memstore
+from cbot.server.operation import Operation
 from cbot.server.task_manager import task_manager
 
 WEBSOCKET_PORT = 2269
-
-
-class JsonCustomEncoder(json.JSONEncoder):
-    def default(self, o: Any):
-        if isinstance(o, Decimal):
-            return str(o)
-        if isinstance(o, Event):
-            return str(o.value)
-        return json.JSONEncoder.default(self, o)
+# clients pick an encoding with the Sec-WebSocket-Protocol header,
+# without one they get JSON
+SUBPROTOCOLS = {
+    'cbot.json': 'json',
+    'cbot.msgpack': 'msgpack',
+}
 
 
 class Server:
+    MAX_IN_FLIGHT = 8
     server: WebSocketServer = None
 
     def __init__(self, addr: str, port: int = WEBSOCKET_PORT):
         self.addr = addr
         self.port = port
-        self.connections: Set[WebSocketServerProtocol] = set()
+        self.connections: Dict[WebSocketServerProtocol, Connection] = {}
 
     async def run(self):
         logger.info('Listening websocket at %s:%d', self.addr, self.port)
-        self.server = await ws_serve(self._handler, self.addr, self.port)
-        event_bus.add_listener(Event.ALL, self.event_to_all)
+        self.server = await ws_serve(self._handler, self.addr, self.port,
+                                     subprotocols=self.get_subprotocols())
+        event_bus.add_listener(Event.ALL, self.event_to_all,
+                               policy=OverflowPolicy.COALESCE)
+        task_manager.stats_providers['ws_connections'] = self.get_stats
 
     def close(self):
         if self.server:
             self.server.close()
 
+    @staticmethod
+    def get_subprotocols() -> List[str]:
+        subprotocols = []
+        for subprotocol, encoding in SUBPROTOCOLS.items():
+            with suppress(ValueError):
+                get_codec(encoding)
+                subprotocols.append(subprotocol)
+        return subprotocols
+
     async def wait_closed(self):
         if self.server:
             return await self.server.wait_closed()
@@ -67,34 +80,40 @@ class Server:
 
     async def _handler(self, ws: WebSocketServerProtocol, _path: str):
         logger.debug('Received connection from %s', ws.remote_address)
-        self.connections.add(ws)
-
-        consumer_task = asyncio.ensure_future(self.consumer_handler(ws, _path))
-        producer_task = asyncio.ensure_future(self.producer_handler(ws, _path))
+        con = Connection(str(ws.remote_address), ws.send,
+                         lambda _con: asyncio.ensure_future(
+                             ws.close(code=1008, reason='Too slow')))
+        if ws.subprotocol:
+            con.codec = get_codec(SUBPROTOCOLS[ws.subprotocol])
+        con.start()
+        self.connections[ws] = con
+        self.send_snapshot(con)
+
+        # outgoing frames are pushed by the event bus through con, an idle
+        # connection has no task of its own to wake up
         try:
             with suppress(asyncio.CancelledError):
-                _done, pending = await asyncio.wait(
-                    [consumer_task, producer_task],
-                    return_when=asyncio.FIRST_COMPLETED,
-                )
-                for task in pending:
-                    task.cancel()
+                await self.consumer_handler(ws, _path)
         finally:
             logger.debug('Closing connection with %s', ws.remote_address)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.connections[ws].drain(), 1)
             try:
                 await ws.close()
             except Exception:
                 pass
-            self.connections.remove(ws)
+            self.connections.pop(ws).close()
 
     async def consumer_handler(self, ws: WebSocketServerProtocol, _path: str):
+        con = self.connections[ws]
+        dispatcher = RequestDispatcher(
+            lambda op, data: self.run_request(con, op, data), self.MAX_IN_FLIGHT)
         try:
             async for request in ws:
                 is_done = False
                 if request:
-                    op = await task_manager.process_request(request)
-                    payload = json.dumps(op.to_stream_response(), default=str)
-                    await ws.send(payload)
+                    op, data = task_manager.parse_request(request, con.codec.decode)
+                    await dispatcher.dispatch(op, data)
                     if op.cmd == 'QUIT':
                         is_done = True
                 else:
@@ -103,35 +122,79 @@ class Server:
                     break
         except ConnectionClosedError:
             pass
-
-    async def producer_handler(self, ws: WebSocketServerProtocol, _path: str):
-        while True:
-            data = await self.producer()
-            if data:
-                d = {
-                    'stream': 'test',
-                    'data': data,
-                }
-                payload = json.dumps(d, default=str)
-                await ws.send(payload)
-
-    async def producer(self):
-        await asyncio.sleep(1)
-        return None
-
-    async def send_to_all(self, stream_name: str, data: Any = None):
-        if data is None:
-            data = {}
-        if self.connections:
-            d = {
-                'stream': stream_name,
-                'data': data
+        finally:
+            dispatcher.cancel()
+
+    async def run_request(self, con: Connection, op: Operation, data: Optional[Dict]):
+        if data is not None:
+            if op.cmd in ('subscribe', 'unsubscribe'):
+                process_subscription(con, op)
+            else:
+                await task_manager.process_parsed(op, data)
+        con.put('RESULT', op.to_stream_response_json())
+        if op.cmd == 'ps':
+            self.send_task_list(con)
+        elif op.cmd == 'subscribe' and op.resp_code == 'OK':
+            events = [Event(name) for name in op.args if name != Event.ALL.value]
+            self.send_snapshot(con, events or None)
+
+    @staticmethod
+    def send_task_list(con: Connection):
+        """Sends a full task list snapshot, TASK_MANAGER diffs follow it"""
+        con.put('RESULT', '{"stream":"%s","data":%s}' % (
+            Event.TASK_MANAGER.value,
+            task_manager.task_list_model.snapshot_json()))
+
+    def send_snapshot(self, con: Connection, events: Optional[List[Event]] = None):
+        """Sends the current state of the given events, all by default, in
+        a single BATCH frame; only deltas need to follow it"""
+        frames = []
+        if (events is None or Event.TASK_MANAGER in events) and \
+                con.subscription.wants(Event.TASK_MANAGER):
+            frames.append('{"stream":"%s","data":%s}' % (
+                Event.TASK_MANAGER.value,
+                task_manager.task_list_model.snapshot_json()))
+        for event_name, data in self.get_snapshot(events):
+            _key, selected = con.subscription.select(event_name, data)
+            if selected is not None:
+                frames.append(self.encode({'stream': event_name, 'data': selected}))
+        if frames:
+            con.put('SNAPSHOT', '{"stream":"BATCH","data":[' + ','.join(frames) + ']}')
+
+    @staticmethod
+    def get_snapshot(events: Optional[List[Event]] = None) -> Iterator[Tuple[Event, Any]]:
+        def wanted(event_name: Event) -> bool:
+            return events is None or event_name in events
+
+        bin_live = memstore.get('bin_live')
+        if wanted(Event.BIN_LIVE_UPDATE) and bin_live:
+            yield Event.BIN_LIVE_UPDATE, {
+                'version': memstore.get('bin_live_version', 0),
+                'full': True,
+                'rows': bin_live,
             }
-            payload = json.dumps(d, cls=JsonCustomEncoder)
-            await asyncio.gather(
-                *[con.send(payload) for con in self.connections],
-                return_exceptions=True  # This ensures that one failing send doesn't cancel others
-            )
+        for event_name, key in ((Event.STREAM_TICKERS, 'stream_tickers'),
+                                (Event.TICKER_UPDATE, 'tickers')):
+            data = memstore.get(key)
+            if wanted(event_name) and data:
+                yield event_name, data
+        if wanted(Event.CRYPTO_TSL_UPDATE):
+            for task in task_manager.tasks.select('crypto_tsl'):
+                if task.data and not task.is_finished:
+                    yield Event.CRYPTO_TSL_UPDATE, {
+                        'taskId': task.id,
+                        'data': task.data.__dict__,
+                    }
+
+    async def send_to_all(self, stream_name: Event, data: Any = None):
+        broadcast(self.connections.values(), stream_name, data, self.encode)
+
+    @staticmethod
+    def encode(d: Any) -> str:
+        return serializer.dumps(d)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [con.stats() for con in self.connections.values()]
 
     async def event_to_all(self, event_name: str, data: Any = None):
         await self.send_to_all(event_name, data)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+# bench_ifttt.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Usage: PYTHONPATH=. ./scripts/bench_ifttt.py [num_conditions] [num_symbols]
+
+import random
+import sys
+import time
+
+from cbot.server.ifttt import IftttEntity, IftttIndex
+from cbot.server.operation import Operation
+
+NUM_CONDITIONS = 10000
+NUM_SYMBOLS = 2000
+ROUNDS = 20
+
+
+def make_board(num_symbols: int):
+    return {
+        'binance': {
+            f'S{i}/USDT': {
+                'last': random.uniform(1, 100),
+                'percentage': random.uniform(-10, 10),
+            } for i in range(num_symbols)
+        }
+    }
+
+
+def make_conditions(num_conditions: int, num_symbols: int, threshold: bool):
+    conditions = []
+    for _ in range(num_conditions):
+        symbol = f'S{random.randrange(num_symbols)}/USDT'
+        level = random.uniform(200, 1000)
+        if threshold:
+            conditions.append(f"binance['{symbol}']['last'] > {level}")
+        else:
+            conditions.append(f"binance['{symbol}']['last'] > {level} and "
+                              f"binance['{symbol}']['percentage'] > 20")
+    return conditions
+
+
+def bench_eval_all(conditions, tickers):
+    """Previous behaviour: eval every raw condition on every update"""
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        for cond in conditions:
+            eval(cond, {}, tickers)  # pylint: disable=eval-used
+    return (time.perf_counter() - t0) / ROUNDS
+
+
+def bench_compiled_all(entries, tickers):
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        for entry in entries:
+            entry.evaluate(tickers)
+    return (time.perf_counter() - t0) / ROUNDS
+
+
+def bench_indexed(index, tickers, changed):
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        for entry in index.lookup(changed, tickers):
+            entry.evaluate(tickers)
+    return (time.perf_counter() - t0) / ROUNDS
+
+
+def run(tickers, num_conditions: int, num_symbols: int, threshold: bool):
+    conditions = make_conditions(num_conditions, num_symbols, threshold)
+
+    t0 = time.perf_counter()
+    entries = [IftttEntity(cond, Operation('ping')) for cond in conditions]
+    index = IftttIndex()
+    for entry in entries:
+        index.add(entry)
+    print(f'{num_conditions} {"threshold" if threshold else "compound"} conditions, '
+          f'{num_symbols} symbols')
+    print(f'  compile + index:      {(time.perf_counter() - t0) * 1000:9.2f} ms (once)')
+
+    symbols = list(tickers['binance'])
+    one = [('binance', symbols[0])]
+    batch = [('binance', s) for s in symbols[:50]]
+    print(f'  eval() all, raw:      {bench_eval_all(conditions, tickers) * 1000:9.3f} ms/update')
+    print(f'  compiled, all:        {bench_compiled_all(entries, tickers) * 1000:9.3f} ms/update')
+    print(f'  indexed, 1 symbol:    {bench_indexed(index, tickers, one) * 1000:9.3f} ms/update')
+    print(f'  indexed, 50 symbols:  {bench_indexed(index, tickers, batch) * 1000:9.3f} ms/update')
+
+
+def main():
+    num_conditions = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_CONDITIONS
+    num_symbols = int(sys.argv[2]) if len(sys.argv) > 2 else NUM_SYMBOLS
+    random.seed(1)
+    tickers = make_board(num_symbols)
+    run(tickers, num_conditions, num_symbols, threshold=False)
+    run(tickers, num_conditions, num_symbols, threshold=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+# bench_serializer.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Usage: PYTHONPATH=. ./scripts/bench_serializer.py [rounds]
+#
+# Encodes payloads shaped like the real stream events with the old
+# ad-hoc json.dumps calls, with every serializer backend and with msgpack,
+# and prints the encode time and the encoded size.
+
+import json
+import random
+import sys
+import time
+import timeit
+from decimal import Decimal
+
+from cbot.server import serializer
+from cbot.server.event_bus import Event
+
+ROUNDS = 2000
+REPEAT = 5
+
+
+def dec(lo: float, hi: float, places: int = 4) -> Decimal:
+    return round(Decimal(random.uniform(lo, hi)), places)
+
+
+def tsl_update():
+    """CRYPTO_TSL_UPDATE, data.__dict__ of a running crypto_tsl task"""
+    data = {
+        'exchange': 'binance', 'symbol': 'EOS/USDT', 'mode': 'sell',
+        'algo': 'tsl', 'simulate': True, 'buy': False, 'iteration': 1234,
+        'interval': 1, 'buy_completed': True, 'simulate_done_iter': 0,
+    }
+    for key in ('currentPrice', 'initialPrice', 'lastHigh', 'stopPrice',
+                'limitPrice', 'stopOffsetPrice', 'stopOffsetPricePct',
+                'limitOffsetPrice', 'quantity', 'available_quantity',
+                'aboveInitialPriceOffset', 'aboveInitialPriceOffsetPct',
+                'offsetPctRaisedBy', 'reduceStopOffsetPriceBy',
+                'reduceStopOffsetPriceByMax', 'takeProfit', 'takeProfitPct'):
+        data[key] = dec(1, 100)
+    return {'stream': Event.CRYPTO_TSL_UPDATE, 'data': {'taskId': 3, 'data': data}}
+
+
+def bin_live_keyframe(num_symbols: int = 200):
+    rows = [{
+        's': f'S{i}USDT',
+        '1m': dec(-2, 2, 2), '3m': dec(-5, 5, 2), '5m': dec(-5, 5, 2),
+        '10m': dec(-9, 9, 2), '15m': dec(-9, 9, 2), 'pts': random.randrange(11),
+    } for i in range(num_symbols)]
+    return {'stream': Event.BIN_LIVE_UPDATE,
+            'data': {'version': 1, 'full': True, 'rows': rows}}
+
+
+def logger_batch(num_lines: int = 100):
+    lines = [{'ts': time.time(), 'taskId': i % 10, 'level': 'info', 'seq': i,
+              'msg': f'#{i % 10}; SS;EOS/USDT;QTY 1.84;H 7.5021;CUR 7.5021'}
+             for i in range(num_lines)]
+    return {'stream': Event.LOGGER, 'data': lines}
+
+
+def ticker_update(num_symbols: int = 500):
+    tickers = {f'S{i}/USDT': {
+        'symbol': f'S{i}/USDT', 'timestamp': 1650000000000, 'datetime': '2022-04-15T05:20:00.000Z',
+        'high': random.uniform(1, 100), 'low': random.uniform(1, 100),
+        'bid': random.uniform(1, 100), 'ask': random.uniform(1, 100),
+        'last': random.uniform(1, 100), 'percentage': random.uniform(-10, 10),
+        'baseVolume': random.uniform(1e3, 1e6), 'quoteVolume': random.uniform(1e3, 1e6),
+        'info': {},
+    } for i in range(num_symbols)}
+    return {'stream': Event.TICKER_UPDATE, 'data': {'binance': tickers}}
+
+
+class OldEncoder(json.JSONEncoder):
+    """ws_server.JsonCustomEncoder before the serializer module"""
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return str(o)
+        if isinstance(o, Event):
+            return str(o.value)
+        return json.JSONEncoder.default(self, o)
+
+
+def bench(encode, payload, rounds: int) -> float:
+    """Best of REPEAT runs, in microseconds per encode"""
+    best = min(timeit.repeat(lambda: encode(payload), number=rounds, repeat=REPEAT))
+    return best / rounds * 1e6
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else ROUNDS
+    random.seed(1)
+    encoders = [
+        ('json.dumps(cls=JsonCustomEncoder)', lambda o: json.dumps(o, cls=OldEncoder)),
+        ('json.dumps(default=str)', lambda o: json.dumps(o, default=str)),
+    ]
+    for backend in serializer.BACKENDS:
+        if backend == 'orjson' and not serializer.orjson:
+            print('orjson is not installed, skipping')
+            continue
+        encoders.append((f'serializer ({backend})',
+                         serializer.orjson_dumps if backend == 'orjson' else serializer.json_dumps))
+    if serializer.msgpack:
+        encoders.append(('serializer.packb (msgpack)', serializer.packb))
+    else:
+        print('msgpack is not installed, skipping')
+
+    for name, payload in (('CRYPTO_TSL_UPDATE', tsl_update()),
+                          ('BIN_LIVE_UPDATE keyframe, 200 rows', bin_live_keyframe()),
+                          ('LOGGER batch, 100 lines', logger_batch()),
+                          ('TICKER_UPDATE, 500 tickers', ticker_update())):
+        n = max(1, rounds // 10) if 'TICKER' in name or 'BIN_LIVE' in name else rounds
+        print(name)
+        for label, encode in encoders:
+            size = len(encode(payload))
+            print(f'  {label:36s} {bench(encode, payload, n):10.1f} us {size:10d} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+# bench_tcp_storm.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Usage: PYTHONPATH=. ./scripts/bench_tcp_storm.py [num_clients ...] [--legacy]
+#
+# Opens num_clients TCP connections at once, as a fleet of cron scripts
+# would, and has each send one framed `ps` request. Reports failed
+# connections (including those not answered within TIMEOUT seconds) and
+# the connect+response latency. --legacy also runs the server with the
+# old listen(1) backlog for comparison.
+
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from cbot.server.framing import FrameDecoder, encode_frame
+from cbot.server.tcp_server import Server
+
+CLIENTS = (200, 1000)
+PORT = 28270
+TIMEOUT = 10
+REQUEST = encode_frame(json.dumps({'cmd': 'ps', 'args': [], 'kwargs': {}}).encode('utf8'))
+
+
+def serve(conn, backlog: int, max_connections: int):
+    async def run_server():
+        server = Server('127.0.0.1', PORT, backlog=backlog,
+                        max_connections=max_connections)
+        await server.run()
+        conn.send('ready')
+        loop = asyncio.get_running_loop()
+        commands = asyncio.Queue()
+        loop.add_reader(conn.fileno(), lambda: commands.put_nowait(conn.recv()))
+        await commands.get()
+        server.close()
+
+    asyncio.run(run_server())
+
+
+async def client() -> float:
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    try:
+        writer.write(REQUEST)
+        decoder = FrameDecoder()
+        decoder.line_mode = False
+        while not decoder.feed(await reader.read(65536)):
+            pass
+        return time.perf_counter() - start
+    finally:
+        writer.close()
+
+
+async def storm(num_clients: int):
+    results = await asyncio.gather(*[asyncio.wait_for(client(), TIMEOUT)
+                                     for _ in range(num_clients)],
+                                   return_exceptions=True)
+    times = sorted(r for r in results if isinstance(r, float))
+    return num_clients - len(times), times
+
+
+def run(num_clients: int, backlog: int, label: str):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve,
+                                     args=(child_conn, backlog, num_clients))
+    server.start()
+    parent_conn.recv()
+    try:
+        start = time.perf_counter()
+        failed, times = asyncio.run(storm(num_clients))
+        total = time.perf_counter() - start
+        if times:
+            p50 = times[len(times) // 2] * 1000
+            p99 = times[int(len(times) * 0.99)] * 1000
+        else:
+            p50 = p99 = float('nan')
+        print(f'{num_clients:6d} clients, {label:14s}: {failed:5d} failed, '
+              f'p50 {p50:8.1f} ms, p99 {p99:8.1f} ms, total {total:6.2f} s')
+    finally:
+        parent_conn.send('quit')
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    clients = [int(a) for a in args] or CLIENTS
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 2 * max(clients) + 100)), hard))
+    for num_clients in clients:
+        run(num_clients, Server.BACKLOG, f'backlog {Server.BACKLOG}')
+        if '--legacy' in sys.argv:
+            run(num_clients, 1, 'backlog 1')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+# bench_ws_idle.py
+#
+# CBot Copyright (C) 2022 Wojciech Polak
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 3 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Usage: PYTHONPATH=. ./scripts/bench_ws_idle.py [num_clients ...]
+#
+# Measures the CPU time the WebSocket server spends while its clients are
+# connected but idle. --polling adds back a per-connection task waking
+# every second, like the removed producer_handler, for comparison.
+
+import asyncio
+import multiprocessing
+import resource
+import sys
+import time
+
+import websockets
+
+from cbot.server import ws_server
+
+CLIENTS = (1000, 5000)
+IDLE_SECONDS = 10
+PORT = 28269
+
+
+def serve(conn, polling: bool):
+    async def poll():
+        while True:
+            await asyncio.sleep(1)
+
+    async def run_server():
+        server = ws_server.Server('127.0.0.1', PORT)
+        if polling:
+            consumer_handler = server.consumer_handler
+
+            async def consumer_with_polling(ws, path):
+                task = asyncio.create_task(poll())
+                try:
+                    await consumer_handler(ws, path)
+                finally:
+                    task.cancel()
+            server.consumer_handler = consumer_with_polling
+        await server.run()
+        loop = asyncio.get_running_loop()
+        commands = asyncio.Queue()
+        loop.add_reader(conn.fileno(), lambda: commands.put_nowait(conn.recv()))
+        while True:
+            cmd = await commands.get()
+            if cmd == 'quit':
+                break
+            conn.send((time.process_time(), len(server.connections)))
+
+    asyncio.run(run_server())
+
+
+async def connect(num_clients: int):
+    clients = []
+    for _ in range(num_clients):
+        clients.append(await websockets.connect(f'ws://127.0.0.1:{PORT}',
+                                                ping_interval=None))
+    return clients
+
+
+async def measure(conn, num_clients: int) -> float:
+    clients = await connect(num_clients)
+    await asyncio.sleep(1)
+    conn.send('cpu')
+    cpu_start, connected = conn.recv()
+    await asyncio.sleep(IDLE_SECONDS)
+    conn.send('cpu')
+    cpu_end, _ = conn.recv()
+    await asyncio.gather(*[c.close() for c in clients])
+    if connected != num_clients:
+        print(f'  warning: {connected} of {num_clients} clients connected')
+    return (cpu_end - cpu_start) / IDLE_SECONDS
+
+
+def run(num_clients: int, polling: bool):
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(child_conn, polling))
+    server.start()
+    time.sleep(1)
+    try:
+        cpu = asyncio.run(measure(parent_conn, num_clients))
+        label = 'polling' if polling else 'event-driven'
+        print(f'{num_clients:6d} idle clients, {label:12s}: '
+              f'{cpu * 100:6.2f}% CPU ({cpu * 1000:7.2f} ms/s)')
+    finally:
+        parent_conn.send('quit')
+        server.join(5)
+        if server.is_alive():
+            server.terminate()
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    clients = [int(a) for a in args] or CLIENTS
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 2 * max(clients) + 100)), hard))
+    for num_clients in clients:
+        run(num_clients, polling=False)
+        if '--polling' in sys.argv:
+            run(num_clients, polling=True)
+
+
+if __name__ == '__main__':
+    main()